@@ -1 +1,5 @@
-from .trajectories import seq_collate, TrajectoryDataset
+from .trajectories import seq_collate, SeqCollate, SEQ_FIELDS
+from .trajectories import TrajectoryDataset, TrackStore
+from .trajectories import StreamingTrajectoryDataset
+from .augmentation import BatchAugmentation
+from .scenes import SceneIndex
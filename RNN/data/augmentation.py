@@ -0,0 +1,93 @@
+import math
+
+import torch
+
+
+class BatchAugmentation(object):
+    """Random transforms of collated TrajectoryDataset batches, applied with
+    tensor ops on the whole batch (on whichever device it lives). All
+    pedestrians of a sequence share one transform, so their relative
+    positions stay consistent for pooling."""
+    def __init__(
+        self, rotate=True, flip_prob=0.5, scale_range=(1., 1.),
+        reverse_prob=0., noise_std=0.
+    ):
+        """
+        Args:
+        - rotate: Rotate every sequence by an angle drawn uniformly in
+        [-pi, pi) around the mean last observed position of its peds
+        - flip_prob: Probability of mirroring a sequence along its x axis
+        - scale_range: (min, max) of the uniform scale of a sequence
+        - reverse_prob: Probability of playing a sequence backwards. The
+        observed part is then the end of the reversed sequence.
+        - noise_std: Standard deviation of the Gaussian noise added to
+        every observed position
+        non_linear_ped is passed through: it is only used to split metrics.
+        """
+        self.rotate = rotate
+        self.flip_prob = flip_prob
+        self.scale_range = scale_range
+        self.reverse_prob = reverse_prob
+        self.noise_std = noise_std
+
+    def transforms(self, num_seq, device, dtype):
+        """
+        Output:
+        - transform: Tensor of shape (num_seq, 2, 2) of random linear maps
+        """
+        rand = torch.rand(num_seq, 3, device=device, dtype=dtype)
+        angle = (2 * rand[:, 0] - 1) * math.pi if self.rotate else \
+            torch.zeros_like(rand[:, 0])
+        flip = 1 - 2 * (rand[:, 1] < self.flip_prob).type(dtype)
+        min_scale, max_scale = self.scale_range
+        scale = min_scale + rand[:, 2] * (max_scale - min_scale)
+        cos, sin = scale * torch.cos(angle), scale * torch.sin(angle)
+        # Rotation and scale after the flip of x
+        return torch.stack([
+            torch.stack([cos * flip, -sin], dim=1),
+            torch.stack([sin * flip, cos], dim=1),
+        ], dim=1)
+
+    def __call__(self, batch):
+        """
+        Input:
+        - batch: Tuple of the SEQ_FIELDS of a batch, as seq_collate makes it
+        Output:
+        - Augmented batch. Relative tensors are recomputed from the augmented
+        positions.
+        """
+        (obs_traj, pred_traj, obs_traj_rel, pred_traj_rel, non_linear_ped,
+         loss_mask, seq_start_end) = batch
+        obs_len = obs_traj.size(0)
+        device, dtype = obs_traj.device, obs_traj.dtype
+        num_seq = seq_start_end.size(0)
+        _len = seq_start_end[:, 1] - seq_start_end[:, 0]
+        seq_idx = torch.repeat_interleave(
+            torch.arange(num_seq, device=device), _len)
+
+        traj = torch.cat([obs_traj, pred_traj], dim=0)
+        if self.reverse_prob > 0:
+            reverse = torch.rand(num_seq, device=device) < self.reverse_prob
+            ped_reverse = reverse[seq_idx]
+            traj = torch.where(
+                ped_reverse[None, :, None], traj.flip(0), traj)
+            loss_mask = torch.where(
+                ped_reverse[:, None], loss_mask.flip(1), loss_mask)
+
+        center = torch.zeros(num_seq, 2, device=device, dtype=dtype)
+        center.index_add_(0, seq_idx, traj[obs_len - 1])
+        center = (center / _len[:, None].type(dtype))[seq_idx]
+        transform = self.transforms(num_seq, device, dtype)[seq_idx]
+        traj = torch.matmul(
+            (traj - center).unsqueeze(2), transform.transpose(1, 2))
+        traj = traj.squeeze(2) + center
+        if self.noise_std > 0:
+            noise = torch.randn_like(traj[:obs_len]) * self.noise_std
+            traj = torch.cat([traj[:obs_len] + noise, traj[obs_len:]], dim=0)
+
+        traj_rel = torch.zeros_like(traj)
+        traj_rel[1:] = traj[1:] - traj[:-1]
+        return (
+            traj[:obs_len], traj[obs_len:], traj_rel[:obs_len],
+            traj_rel[obs_len:], non_linear_ped, loss_mask, seq_start_end
+        )
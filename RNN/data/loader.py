@@ -1,6 +1,15 @@
+import os
+
+import torch
 from torch.utils.data import DataLoader
 
-from trajectories import TrajectoryDataset, seq_collate
+from samplers import ContiguousBlockSampler, PedestrianBucketSampler
+from trajectories import SEQ_FIELDS, SeqCollate, SeqRanges
+from trajectories import TrajectoryDataset, seq_range_collate
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'trajectories')
+
 
 def data_loader(args, path):
     dset = TrajectoryDataset(
@@ -8,12 +17,92 @@ def data_loader(args, path):
         obs_len=args.obs_len,
         pred_len=args.pred_len,
         skip=args.skip,
-        delim=args.delim)
+        delim=args.delim,
+        cache_dir=getattr(args, 'cache_dir', DEFAULT_CACHE_DIR),
+        lazy=getattr(args, 'lazy', False),
+        compact=getattr(args, 'compact', False))
 
-    loader = DataLoader(
-        dset,
-        batch_size=args.batch_size,
-        shuffle=True,
-        num_workers=args.loader_num_workers,
-        collate_fn=seq_collate)
+    if getattr(args, 'contiguous_batches', False):
+        return dset, block_loader(args, dset, shuffle=True)
+
+    max_peds = getattr(args, 'max_peds_per_batch', 0)
+    max_pairs = getattr(args, 'max_pairs_per_batch', 0)
+    if max_peds or max_pairs:
+        batching = {'batch_sampler': PedestrianBucketSampler(
+            dset.seq_start_end, max_peds=max_peds, max_pairs=max_pairs)}
+    else:
+        batching = {'batch_size': args.batch_size, 'shuffle': True}
+
+    fields = getattr(args, 'collate_fields', SEQ_FIELDS)
+    # Flag defaults are not passed through bool_flag
+    pin_memory = bool(getattr(args, 'pin_memory', False))
+    pin_memory = pin_memory and torch.cuda.is_available()
+    if args.loader_num_workers:
+        # Workers only send index ranges, the batches are gathered from the
+        # dataset in shared memory
+        loader = SeqRangeLoader(
+            dset, fields=fields, pin_memory=pin_memory,
+            num_workers=args.loader_num_workers, **batching)
+        return dset, loader
+
+    # Reusing collate buffers is only safe when batches are collated in the
+    # process that consumes them, and no batch is kept (see SeqCollate)
+    collate_fn = SeqCollate(
+        fields=fields, num_buffers=getattr(args, 'collate_buffers', 0),
+        pin_memory=pin_memory)
+    loader = DataLoader(dset, collate_fn=collate_fn, **batching)
     return dset, loader
+
+
+def block_loader(args, dset, shuffle=False):
+    """
+    Input:
+    - args: Namespace with batch_size
+    - dset: TrajectoryDataset
+    - shuffle: Shuffle the blocks. False makes one sequential pass, for
+    evaluation.
+    Output:
+    - DataLoader whose batches are views of args.batch_size consecutive
+    sequences of dset. Batches are loaded in the main process: there is
+    no copy to offload, and sending a view from a worker would move the
+    whole dataset storage to shared memory.
+    """
+    pin_memory = bool(getattr(args, 'pin_memory', False))
+    return DataLoader(
+        dset,
+        sampler=ContiguousBlockSampler(
+            len(dset), args.batch_size, shuffle=shuffle),
+        batch_size=None,
+        pin_memory=pin_memory and torch.cuda.is_available())
+
+
+class SeqRangeLoader(object):
+    """Multi-worker loader of a TrajectoryDataset held in shared memory.
+    Workers only batch pedestrian ranges (SeqRanges) and this process gathers
+    the batch from the shared tensors, so no trajectory data is pickled
+    through the worker queues."""
+    def __init__(self, dset, fields=SEQ_FIELDS, pin_memory=False, **kwargs):
+        """
+        Args:
+        - dset: TrajectoryDataset. Its tensors are moved to shared memory.
+        - fields: Names from SEQ_FIELDS of the tensors to return, in order
+        - pin_memory: Copy the batches to page-locked memory
+        - kwargs: Batching arguments of DataLoader (batch_size, shuffle,
+        batch_sampler, num_workers, ...)
+        """
+        self.dset = dset.share_memory()
+        self.fields = tuple(fields)
+        self.pin_memory = pin_memory
+        self.loader = DataLoader(
+            SeqRanges(dset.seq_start_end), collate_fn=seq_range_collate,
+            **kwargs)
+
+    def __iter__(self):
+        for peds, seq_start_end in self.loader:
+            batch = self.dset.gather(peds, seq_start_end, self.fields)
+            if self.pin_memory:
+                batch = tuple(tensor.pin_memory() for tensor in batch)
+            yield batch
+
+    def __len__(self):
+        return len(self.loader)
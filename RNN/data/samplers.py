@@ -0,0 +1,124 @@
+import random
+
+import numpy as np
+
+from torch.utils.data import Sampler
+
+
+class PedestrianBucketSampler(Sampler):
+    """Batch sampler that groups sequences with similar numbers of
+    pedestrians and fills every batch up to a budget of pedestrians or
+    pedestrian pairs, instead of a fixed number of sequences"""
+    def __init__(
+        self, seq_start_end, max_peds=0, max_pairs=0, shuffle=True, seed=None
+    ):
+        """
+        Args:
+        - seq_start_end: List of (start, end) tuples of the dataset
+        - max_peds: Maximum number of pedestrians in a batch. 0 disables.
+        - max_pairs: Maximum sum over sequences of num_peds ** 2, which is
+        what PoolHiddenNet and SocialPooling scale with. 0 disables.
+        - shuffle: Shuffle sequences inside buckets and batches across
+        buckets every epoch
+        - seed: Seed of the shuffling
+        A sequence larger than the budget on its own gets a batch to itself.
+        """
+        if not max_peds and not max_pairs:
+            raise ValueError('Either max_peds or max_pairs must be set')
+        self.num_peds = np.array([end - start for start, end in seq_start_end])
+        self.max_peds = max_peds
+        self.max_pairs = max_pairs
+        self.shuffle = shuffle
+        self.rng = random.Random(seed)
+        # Buckets double in width: 2-3 peds, 4-7 peds, 8-15 peds, ...
+        bucket_ids = np.floor(np.log2(np.maximum(self.num_peds, 1)))
+        self.buckets = [
+            np.flatnonzero(bucket_ids == bucket_id).tolist()
+            for bucket_id in np.unique(bucket_ids)
+        ]
+        self.batches = self.make_batches()
+        self.used = False
+
+    def make_batches(self):
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = list(bucket)
+                self.rng.shuffle(bucket)
+            batch, peds, pairs = [], 0, 0
+            for idx in bucket:
+                num_peds = int(self.num_peds[idx])
+                if batch and (
+                    (self.max_peds and peds + num_peds > self.max_peds) or
+                    (self.max_pairs and
+                     pairs + num_peds ** 2 > self.max_pairs)
+                ):
+                    batches.append(batch)
+                    batch, peds, pairs = [], 0, 0
+                batch.append(idx)
+                peds += num_peds
+                pairs += num_peds ** 2
+            if batch:
+                batches.append(batch)
+        if self.shuffle:
+            self.rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        # Batches are made ahead of the epoch so that __len__ is exact
+        if self.used:
+            self.batches = self.make_batches()
+        self.used = True
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+class ContiguousBlockSampler(Sampler):
+    """Sampler of blocks of consecutive sequences, to be used with
+    DataLoader(batch_size=None) so that every batch comes straight out of
+    TrajectoryDataset.get_block without __getitem__ or torch.cat"""
+    def __init__(self, num_seq, block_size, shuffle=True, seed=None):
+        """
+        Args:
+        - num_seq: Number of sequences of the dataset
+        - block_size: Number of sequences in a block
+        - shuffle: Shuffle the order of the blocks every epoch and move
+        their boundaries by a random offset, so the same sequences are not
+        always batched together. Without it blocks cover the dataset in
+        order, which is what evaluation loops need.
+        - seed: Seed of the shuffling
+        """
+        if block_size < 1:
+            raise ValueError('block_size must be positive')
+        self.num_seq = num_seq
+        self.block_size = block_size
+        self.shuffle = shuffle
+        self.rng = random.Random(seed)
+        self.blocks = self.make_blocks()
+        self.used = False
+
+    def make_blocks(self):
+        if not self.num_seq:
+            return []
+        offset = self.rng.randrange(self.block_size) if self.shuffle else 0
+        bounds = [0] + list(range(
+            offset or self.block_size, self.num_seq, self.block_size))
+        bounds.append(self.num_seq)
+        blocks = [
+            slice(start, end) for start, end in zip(bounds, bounds[1:])
+        ]
+        if self.shuffle:
+            self.rng.shuffle(blocks)
+        return blocks
+
+    def __iter__(self):
+        # Blocks are made ahead of the epoch so that __len__ is exact
+        if self.used:
+            self.blocks = self.make_blocks()
+        self.used = True
+        return iter(self.blocks)
+
+    def __len__(self):
+        return len(self.blocks)
@@ -0,0 +1,94 @@
+import numpy as np
+
+from torch.utils.data import Subset, SubsetRandomSampler
+
+
+class SceneIndex(object):
+    """Columnar index of the sequences (scenes) of a TrajectoryDataset, built
+    from the metadata recorded with the dataset, so that scenes are filtered
+    without touching the trajectory tensors"""
+    def __init__(self, dset):
+        """
+        Args:
+        - dset: TrajectoryDataset
+        The columns, one entry per sequence, are
+        - file: Index in file_names of the file of the sequence
+        - frame: Frame id of the first frame
+        - num_peds: Number of pedestrians
+        - non_linear: Fraction of non linear pedestrians
+        - bbox: Shape (num_seq, 4). x_min, y_min, x_max, y_max of all the
+        positions of the sequence
+        """
+        self.dset = dset
+        self.file_names = list(dset.file_names)
+        meta = dset.scene_meta
+        self.file = meta['file']
+        self.frame = meta['frame']
+        self.num_peds = meta['num_peds']
+        self.non_linear = meta['non_linear']
+        self.bbox = meta['bbox']
+
+    def __len__(self):
+        return len(self.num_peds)
+
+    def file_mask(self, pattern):
+        """Mask of the sequences of the files whose name contains pattern"""
+        match = np.array(
+            [pattern in name for name in self.file_names], dtype=bool)
+        return match[self.file]
+
+    def query(
+        self, file=None, min_peds=None, max_peds=None, min_non_linear=None,
+        max_non_linear=None, frames=None, region=None, mask=None
+    ):
+        """
+        Input: All conditions are optional and combined with and
+        - file: Substring of the file name, for example 'zara02'
+        - min_peds, max_peds: Bounds (inclusive) of the number of peds
+        - min_non_linear, max_non_linear: Bounds (inclusive) of the fraction
+        of non linear peds
+        - frames: (first, last) range (inclusive) of the start frame
+        - region: (x_min, y_min, x_max, y_max) the sequence has to lie in
+        - mask: Boolean numpy array over the sequences, for conditions on the
+        columns that are not covered above
+        Output:
+        - indices: Numpy array of the indices of the matching sequences
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if file is not None:
+            keep &= self.file_mask(file)
+        if min_peds is not None:
+            keep &= self.num_peds >= min_peds
+        if max_peds is not None:
+            keep &= self.num_peds <= max_peds
+        if min_non_linear is not None:
+            keep &= self.non_linear >= min_non_linear
+        if max_non_linear is not None:
+            keep &= self.non_linear <= max_non_linear
+        if frames is not None:
+            keep &= (self.frame >= frames[0]) & (self.frame <= frames[1])
+        if region is not None:
+            keep &= np.all(self.bbox[:, :2] >= region[:2], axis=1)
+            keep &= np.all(self.bbox[:, 2:] <= region[2:], axis=1)
+        if mask is not None:
+            keep &= mask
+        return np.flatnonzero(keep)
+
+    def subset(self, **conditions):
+        """Subset of the dataset with the sequences matching conditions (see
+        query)"""
+        return Subset(self.dset, self.query(**conditions).tolist())
+
+    def sampler(self, shuffle=True, **conditions):
+        """
+        Input:
+        - shuffle: Sample in random order every epoch
+        - conditions: See query
+        Output:
+        - Sampler of the dataset over the matching sequences, for
+        DataLoader(dset, sampler=...). Without shuffle, the list of indices.
+        """
+        indices = self.query(**conditions).tolist()
+        if shuffle:
+            return SubsetRandomSampler(indices)
+        return indices
@@ -1,53 +1,345 @@
+import collections
+import functools
+import hashlib
 import logging
+import multiprocessing
 import os
-import math
+import random
+import shutil
+import time
+import warnings
 
 import numpy as np
 
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever the way tensors are built changes to invalidate old caches
+CACHE_VERSION = 4
+
+# Positions are rounded to 4 decimals, so compact datasets store them exactly
+# as integers in units of 1 / FIXED_POINT_SCALE
+FIXED_POINT_SCALE = 10 ** 4
+
+# Splits can be manifests: one line <object path>\t<file name> per file,
+# with object paths relative to the manifest, pointing into a file store
+MANIFEST_EXT = '.manifest'
+
+# Binary scene files: a 32 byte header (magic, version, num_rows,
+# num_frames) followed by the columns frame_ids int32 (num_rows, ),
+# ped_ids int32 (num_rows, ), xy float32 (num_rows, 2), frames int32
+# (num_frames, ) and frame_offsets int64 (num_frames + 1, ). Rows are sorted
+# by frame and rows frame_offsets[i]:frame_offsets[i + 1] belong to frames[i].
+BINARY_MAGIC = b'TRAJ'
+BINARY_VERSION = 1
+BINARY_EXT = '.traj'
+BINARY_HEADER = np.dtype([
+    ('magic', 'S4'), ('version', '<u4'), ('num_rows', '<u8'),
+    ('num_frames', '<u8'), ('pad', 'V8')
+])
+
+
+SEQ_FIELDS = (
+    'obs_traj', 'pred_traj', 'obs_traj_rel', 'pred_traj_rel',
+    'non_linear_ped', 'loss_mask', 'seq_start_end'
+)
+
+
+class SeqCollate(object):
+    """Collate function for TrajectoryDataset sequences"""
+    def __init__(self, fields=SEQ_FIELDS, num_buffers=0, pin_memory=False):
+        """
+        Args:
+        - fields: Names from SEQ_FIELDS of the tensors to return, in order.
+        Fields that are not requested are not computed.
+        - num_buffers: When > 0, tensors are written into num_buffers sets of
+        buffers that are reused round robin, so a batch is overwritten
+        num_buffers batches later: a batch must not be used, or kept (for
+        example by list(loader) or by accumulating predictions), once
+        num_buffers more batches have been collated. Copy what has to
+        outlive that. Only use it when batches are consumed in the process
+        that collates them, i.e. DataLoader(num_workers=0). 0 (default)
+        returns fresh tensors for every batch.
+        - pin_memory: Allocate the output in page-locked memory
+        """
+        unknown = set(fields) - set(SEQ_FIELDS)
+        if unknown:
+            raise ValueError('Unknown fields %s' % sorted(unknown))
+        self.fields = tuple(fields)
+        self.num_buffers = num_buffers
+        self.pin_memory = bool(pin_memory)
+        self.buffers = [{} for _ in range(num_buffers)]
+        self.buffer_idx = 0
+
+    def empty(self, name, shape, dtype):
+        numel = int(np.prod(shape))
+        if not self.num_buffers:
+            return torch.empty(shape, dtype=dtype, pin_memory=self.pin_memory)
+        buffers = self.buffers[self.buffer_idx]
+        buf = buffers.get(name)
+        if buf is None or buf.numel() < numel:
+            # Grow geometrically so that buffers settle after a few batches
+            size = numel if buf is None else max(numel, 2 * buf.numel())
+            buf = torch.empty(size, dtype=dtype, pin_memory=self.pin_memory)
+            buffers[name] = buf
+        return buf[:numel].view(shape)
+
+    def __call__(self, data):
+        columns = dict(zip(SEQ_FIELDS, zip(*data)))
+        _len = [len(seq) for seq in columns['obs_traj']]
+        num_peds = sum(_len)
+        out = []
+        for name in self.fields:
+            if name == 'seq_start_end':
+                cum_start_idx = [0] + np.cumsum(_len).tolist()
+                seq_start_end = [
+                    [start, end]
+                    for start, end in zip(cum_start_idx, cum_start_idx[1:])
+                ]
+                out.append(torch.LongTensor(seq_start_end))
+                continue
+            seqs = columns[name]
+            shape = (num_peds, ) + tuple(seqs[0].shape[1:])
+            tensor = torch.cat(
+                seqs, dim=0, out=self.empty(name, shape, seqs[0].dtype))
+            if tensor.dim() == 3:
+                # Data format: batch, input_size, seq_len
+                # LSTM input format: seq_len, batch, input_size
+                tensor = tensor.permute(2, 0, 1)
+            out.append(tensor)
+        if self.num_buffers:
+            self.buffer_idx = (self.buffer_idx + 1) % self.num_buffers
+        return tuple(out)
+
 
 def seq_collate(data):
-    (obs_seq_list, pred_seq_list, obs_seq_rel_list, pred_seq_rel_list,
-     non_linear_ped_list, loss_mask_list) = zip(*data)
-
-    _len = [len(seq) for seq in obs_seq_list]
-    cum_start_idx = [0] + np.cumsum(_len).tolist()
-    seq_start_end = [[start, end]
-                     for start, end in zip(cum_start_idx, cum_start_idx[1:])]
-
-    # Data format: batch, input_size, seq_len
-    # LSTM input format: seq_len, batch, input_size
-    obs_traj = torch.cat(obs_seq_list, dim=0).permute(2, 0, 1)
-    pred_traj = torch.cat(pred_seq_list, dim=0).permute(2, 0, 1)
-    obs_traj_rel = torch.cat(obs_seq_rel_list, dim=0).permute(2, 0, 1)
-    pred_traj_rel = torch.cat(pred_seq_rel_list, dim=0).permute(2, 0, 1)
-    non_linear_ped = torch.cat(non_linear_ped_list)
-    loss_mask = torch.cat(loss_mask_list, dim=0)
-    seq_start_end = torch.LongTensor(seq_start_end)
-    out = [
-        obs_traj, pred_traj #, obs_traj_rel, pred_traj_rel, non_linear_ped,
-        # loss_mask, seq_start_end
-    ]
+    """
+    Output: Tuple (obs_traj, pred_traj, obs_traj_rel, pred_traj_rel,
+    non_linear_ped, loss_mask, seq_start_end)
+    """
+    return SeqCollate()(data)
 
-    return tuple(out)
+
+def read_file(_path, delim='\t', dtype=np.float64):
+    """
+    Input:
+    - _path: Path of a text file with one row of numbers per line, or of a
+    binary scene file written by write_binary
+    - delim: Delimiter between numbers; 'tab' and 'space' are aliases
+    - dtype: Numpy dtype of the output
+    Output:
+    - data: Numpy array of shape (num_rows, num_cols)
+    """
+    if is_binary(_path):
+        scene = read_binary(_path)
+        data = np.empty((len(scene['frame_ids']), 4), dtype=dtype)
+        data[:, 0] = scene['frame_ids']
+        data[:, 1] = scene['ped_ids']
+        data[:, 2:] = scene['xy']
+        return data
+    with open(_path, 'r') as f:
+        text = f.read()
+    return parse_rows(text, delim, _path).astype(dtype, copy=False)
 
 
-def read_file(_path, delim='\t'):
-    data = []
+def parse_rows(text, delim='\t', _path='<string>'):
+    """
+    Input:
+    - text: Rows of numbers, one per line
+    - delim: Delimiter between numbers; 'tab' and 'space' are aliases
+    - _path: Name of the source used in error messages
+    Output:
+    - data: Numpy float64 array of shape (num_rows, num_cols)
+    """
     if delim == 'tab':
         delim = '\t'
     elif delim == 'space':
         delim = ' '
+    if delim.strip():
+        text = text.replace(delim, ' ')
+    num_cols = len(text.lstrip().split('\n', 1)[0].split())
+    if num_cols == 0:
+        return np.zeros((0, 4))
+    # With a whitespace separator fromstring treats tabs and newlines as
+    # separators too, so the whole file is parsed by a single C loop. On a
+    # token that is not a number, older numpy stops there with a warning and
+    # newer numpy raises, so check that every token was read.
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            data = np.fromstring(text, dtype=np.float64, sep=' ')
+    except ValueError:
+        data = None
+    if (
+        data is None or data.size != len(text.split()) or
+        data.size % num_cols != 0
+    ):
+        raise ValueError('Malformed dataset file "%s"' % _path)
+    return data.reshape(-1, num_cols)
+
+
+def _binary_layout(num_rows, num_frames):
+    """Byte offset, dtype and shape of every column of a binary scene file"""
+    columns = [
+        ('frame_ids', '<i4', (num_rows, )),
+        ('ped_ids', '<i4', (num_rows, )),
+        ('xy', '<f4', (num_rows, 2)),
+        ('frames', '<i4', (num_frames, )),
+        ('frame_offsets', '<i8', (num_frames + 1, )),
+    ]
+    layout = []
+    offset = BINARY_HEADER.itemsize
+    for name, dtype, shape in columns:
+        dtype = np.dtype(dtype)
+        # Align every column to its itemsize so it can be mapped in place
+        offset += -offset % dtype.itemsize
+        layout.append((name, offset, dtype, shape))
+        offset += dtype.itemsize * int(np.prod(shape))
+    return layout, offset
+
+
+def is_binary(_path):
+    with open(_path, 'rb') as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def write_binary(_path, data):
+    """
+    Input:
+    - _path: Output path of the binary scene file
+    - data: Numpy array of shape (num_rows, 4) in the format
+    <frame_id> <ped_id> <x> <y>
+    """
+    ids = data[:, :2]
+    if not np.array_equal(ids, np.around(ids)):
+        raise ValueError('Frame and ped ids must be integers')
+    order = np.argsort(data[:, 0], kind='mergesort')
+    frame_ids = data[order, 0].astype(np.int32)
+    frames, counts = np.unique(frame_ids, return_counts=True)
+    columns = {
+        'frame_ids': frame_ids,
+        'ped_ids': data[order, 1].astype(np.int32),
+        # Coordinates are rounded the way TrajectoryDataset rounds them, so
+        # rounding the float32 values again gives back the same float64s.
+        'xy': np.around(data[order, 2:4], decimals=4).astype(np.float32),
+        'frames': frames.astype(np.int32),
+        'frame_offsets': np.concatenate([[0], np.cumsum(counts)]),
+    }
+    layout, _ = _binary_layout(len(order), len(frames))
+    header = np.zeros(1, dtype=BINARY_HEADER)
+    header['magic'] = BINARY_MAGIC
+    header['version'] = BINARY_VERSION
+    header['num_rows'] = len(order)
+    header['num_frames'] = len(frames)
+    with open(_path, 'wb') as f:
+        f.write(header.tobytes())
+        for name, offset, dtype, shape in layout:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+
+def read_binary(_path):
+    """
+    Input:
+    - _path: Path of a binary scene file written by write_binary
+    Output:
+    - scene: Dict mapping column names to read-only numpy memmaps
+    """
+    header = np.fromfile(_path, dtype=BINARY_HEADER, count=1)
+    if len(header) == 0 or header['magic'][0] != BINARY_MAGIC:
+        raise ValueError('"%s" is not a binary scene file' % _path)
+    if header['version'][0] != BINARY_VERSION:
+        raise ValueError('Unsupported binary scene version %d in "%s"' %
+                         (header['version'][0], _path))
+    num_rows = int(header['num_rows'][0])
+    num_frames = int(header['num_frames'][0])
+    layout, size = _binary_layout(num_rows, num_frames)
+    buf = np.memmap(_path, dtype=np.uint8, mode='r', shape=(size, ))
+    scene = {}
+    for name, offset, dtype, shape in layout:
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        scene[name] = buf[offset:offset + nbytes].view(dtype).reshape(shape)
+    return scene
+
+
+def iter_frames(_path, delim='\t', start=0, stop=None, chunk_bytes=1 << 20):
+    """
+    Input:
+    - _path: Path of a dataset file sorted by frame, text or binary
+    - delim: See read_file
+    - start, stop: Range of frame indices (positions among the frames of the
+    file) to read
+    - chunk_bytes: Approximate number of bytes of text parsed at once
+    Output: Generator of (frame_idx, rows) where rows is a numpy array of
+    shape (num_rows_in_frame, 4) in the format <frame_id> <ped_id> <x> <y>
+    """
+    if is_binary(_path):
+        scene = read_binary(_path)
+        offsets = scene['frame_offsets']
+        num_frames = len(scene['frames'])
+        stop = num_frames if stop is None else min(stop, num_frames)
+        for frame_idx in range(start, stop):
+            begin, end = offsets[frame_idx], offsets[frame_idx + 1]
+            rows = np.empty((end - begin, 4))
+            rows[:, 0] = scene['frame_ids'][begin:end]
+            rows[:, 1] = scene['ped_ids'][begin:end]
+            rows[:, 2:] = scene['xy'][begin:end]
+            yield frame_idx, rows
+        return
+
+    frame_idx = -1
+    pending = np.zeros((0, 4))
     with open(_path, 'r') as f:
-        for line in f:
-            line = line.strip().split(delim)
-            line = [float(i) for i in line]
-            data.append(line)
-    return np.asarray(data)
+        while stop is None or frame_idx + 1 < stop:
+            lines = f.readlines(chunk_bytes)
+            data = np.concatenate(
+                [pending, parse_rows(''.join(lines), delim, _path)])
+            if (np.diff(data[:, 0]) < 0).any():
+                raise ValueError('"%s" is not sorted by frame' % _path)
+            frames = np.split(
+                data, np.flatnonzero(np.diff(data[:, 0])) + 1)
+            # The last frame may continue in the next chunk
+            pending = frames.pop() if lines else np.zeros((0, 4))
+            for rows in frames:
+                if not len(rows):
+                    continue
+                frame_idx += 1
+                if stop is not None and frame_idx >= stop:
+                    return
+                if frame_idx >= start:
+                    yield frame_idx, rows
+            if not lines:
+                return
+
+
+def _read_file_star(args):
+    return read_file(*args)
+
+
+def read_files(paths, delim='\t', dtype=np.float64, num_workers=0):
+    """
+    Input:
+    - paths: List of paths of dataset files
+    - delim, dtype: See read_file
+    - num_workers: Number of processes parsing files in parallel. 0 parses
+    in the calling process.
+    Output:
+    - data: List of numpy arrays, one per path
+    """
+    t0 = time.time()
+    jobs = [(path, delim, dtype) for path in paths]
+    if num_workers > 0 and len(paths) > 1:
+        with multiprocessing.Pool(min(num_workers, len(paths))) as pool:
+            data = pool.map(_read_file_star, jobs)
+    else:
+        data = [_read_file_star(job) for job in jobs]
+    duration = max(time.time() - t0, 1e-9)
+    num_rows = sum(len(_data) for _data in data)
+    logger.info('Parsed {} rows from {} files in {:.3f}s ({:.0f} rows/sec)'
+                .format(num_rows, len(paths), duration, num_rows / duration))
+    return data
 
 
 def poly_fit(traj, traj_len, threshold):
@@ -62,21 +354,448 @@ def poly_fit(traj, traj_len, threshold):
     t = np.linspace(0, traj_len - 1, traj_len)
     res_x = np.polyfit(t, traj[0, -traj_len:], 2, full=True)[1]
     res_y = np.polyfit(t, traj[1, -traj_len:], 2, full=True)[1]
-    if res_x + res_y >= threshold:
+    # No residuals are returned when traj_len <= 3 as the fit is exact
+    if len(res_x) and res_x + res_y >= threshold:
         return 1.0
     else:
         return 0.0
 
+
+@functools.lru_cache(maxsize=None)
+def quadratic_residual_matrix(traj_len):
+    """
+    Input:
+    - traj_len: Len of trajectory
+    Output:
+    - Numpy array of shape (traj_len, traj_len) mapping a trajectory sampled
+    at t = 0, ..., traj_len - 1 to its residuals after a least squares fit
+    of a quadratic in t
+    """
+    t = np.linspace(0, traj_len - 1, traj_len)
+    vander = np.vander(t, 3)
+    return np.eye(traj_len) - vander.dot(np.linalg.pinv(vander))
+
+
+def non_linear_flags(traj, traj_len, threshold):
+    """
+    Vectorized poly_fit over a batch of trajectories.
+    Input:
+    - traj: Numpy array of shape (num_peds, 2, seq_len)
+    - traj_len: Len of trajectory
+    - threshold: Minimum error to be considered for non linear traj
+    Output:
+    - Numpy array of shape (num_peds, ): 1 -> Non Linear 0-> Linear
+    """
+    proj = quadratic_residual_matrix(traj_len)
+    res = np.matmul(traj[:, :, -traj_len:], proj)
+    res = (res**2).sum(axis=2).sum(axis=1)
+    flags = (res >= threshold).astype(np.float32)
+    # Whether a residual right at the threshold passes depends on rounding,
+    # so settle those few with poly_fit itself to match it exactly.
+    for i in np.flatnonzero(np.isclose(res, threshold, rtol=1e-9, atol=0)):
+        flags[i] = poly_fit(traj[i], traj_len, threshold)
+    return flags
+
+
+def sort_tracks(data):
+    """
+    Input:
+    - data: Numpy array of shape (num_rows, 4) in the format
+    <frame_id> <ped_id> <x> <y>
+    Output:
+    - frame_idx: Position of every row's frame among the sorted unique frames
+    - ped_ids: Pedestrian id of every row
+    - traj: Numpy array of shape (num_rows, 2) with coordinates rounded to 4
+    decimals
+    - run_len: Number of rows, starting at this one, in which the same
+    pedestrian is seen in consecutive frames
+    All outputs are ordered by (ped_id, frame).
+    """
+    frames = np.unique(data[:, 0])
+    frame_idx = np.searchsorted(frames, data[:, 0])
+    order = np.lexsort((frame_idx, data[:, 1]))
+    frame_idx = frame_idx[order]
+    ped_ids = data[order, 1]
+    traj = np.around(data[order, 2:4], decimals=4)
+
+    num_rows = len(order)
+    run_start = np.ones(num_rows, dtype=bool)
+    run_start[1:] = ((ped_ids[1:] != ped_ids[:-1]) |
+                     (frame_idx[1:] != frame_idx[:-1] + 1))
+    run_id = np.cumsum(run_start) - 1
+    run_end = np.append(np.flatnonzero(run_start)[1:], num_rows)
+    run_len = run_end[run_id] - np.arange(num_rows)
+    return frame_idx, ped_ids, traj, run_len
+
+
+def gather_windows(traj, start_rows, seq_len):
+    """
+    Input:
+    - traj: Numpy array of shape (num_rows, 2) from sort_tracks
+    - start_rows: Numpy array of shape (num_peds, ) from index_windows
+    - seq_len: Number of frames in a window
+    Output:
+    - seq: Numpy array of shape (num_peds, 2, seq_len)
+    """
+    rows = start_rows[:, None] + np.arange(seq_len)
+    return traj[rows].transpose(0, 2, 1)
+
+
+def cache_key(all_files, *args):
+    """
+    Input:
+    - all_files: Paths of the dataset files
+    - args: Dataset arguments that change the built tensors
+    Output:
+    - key: Hex digest of the file contents and the arguments
+    """
+    sha = hashlib.sha1()
+    sha.update(repr((CACHE_VERSION, ) + args).encode('utf-8'))
+    for path in all_files:
+        with open(path, 'rb') as f:
+            sha.update(hashlib.sha1(f.read()).digest())
+    return sha.hexdigest()
+
+
+def save_cache(cache_path, **arrays):
+    """Write arrays to cache_path as an uncompressed npz archive"""
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # Write to a temporary file first so that concurrent runs never read a
+    # partially written cache.
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+def file_digest(_path):
+    with open(_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def store_file(_path, store_dir):
+    """
+    Input:
+    - _path: Path of a dataset file
+    - store_dir: Root of a content-addressed file store
+    Output:
+    - object_path: Path of the copy of the file in the store. Files with the
+    same content are stored once.
+    """
+    digest = file_digest(_path)
+    object_path = os.path.join(
+        store_dir, 'objects', digest[:2],
+        digest + os.path.splitext(_path)[1])
+    if not os.path.isfile(object_path):
+        object_dir = os.path.dirname(object_path)
+        if not os.path.isdir(object_dir):
+            os.makedirs(object_dir)
+        tmp_path = '{}.{}.tmp'.format(object_path, os.getpid())
+        shutil.copyfile(_path, tmp_path)
+        os.replace(tmp_path, object_path)
+    return object_path
+
+
+def write_manifest(manifest_path, object_paths, names):
+    """Write the manifest of a split made of the given store objects"""
+    manifest_dir = os.path.dirname(manifest_path)
+    if manifest_dir and not os.path.isdir(manifest_dir):
+        os.makedirs(manifest_dir)
+    with open(manifest_path, 'w') as f:
+        for object_path, name in zip(object_paths, names):
+            f.write('{}\t{}\n'.format(
+                os.path.relpath(object_path, manifest_dir), name))
+
+
+def read_manifest(manifest_path):
+    """
+    Output:
+    - entries: List of (object path, file name) of the split, in manifest
+    order
+    """
+    manifest_dir = os.path.dirname(manifest_path)
+    entries = []
+    with open(manifest_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            object_path, name = line.rstrip('\n').split('\t')
+            entries.append((
+                os.path.normpath(os.path.join(manifest_dir, object_path)),
+                name))
+    return entries
+
+
+def list_files(data_dir, names=False):
+    """
+    Input:
+    - data_dir: Directory of dataset files or manifest of a split
+    - names: Also return the file names, which are the original names of
+    the files for manifests
+    Output: Sorted by file name, so that a split has the same sequence order
+    from its directory and from its manifest
+    - all_files: Paths of the dataset files
+    - file_names: Only with names
+    """
+    if data_dir.endswith(MANIFEST_EXT):
+        entries = sorted(read_manifest(data_dir), key=lambda entry: entry[1])
+        all_files = [object_path for object_path, _ in entries]
+        file_names = [name for _, name in entries]
+    else:
+        file_names = sorted(os.listdir(data_dir))
+        all_files = [os.path.join(data_dir, _path) for _path in file_names]
+    if names:
+        return all_files, file_names
+    return all_files
+
+
+class TrackStore(object):
+    """Pedestrian tracks of a set of dataset files, sorted once so that the
+    windows of any (obs_len, pred_len, skip) can be indexed without reading
+    the files again"""
+    def __init__(self, all_files, delim='\t', num_workers=0, cache_dir=None):
+        """
+        Args:
+        - all_files: Paths of the dataset files
+        - delim: Delimiter in the dataset files
+        - num_workers: Number of processes parsing the dataset files
+        - cache_dir: Directory where the sorted tracks are cached, keyed by
+        the content of the dataset files. None disables the cache.
+        """
+        self.all_files = all_files
+
+        cache_path = None
+        if cache_dir:
+            key = cache_key(all_files, 'tracks', delim)
+            cache_path = os.path.join(cache_dir, key + '.npz')
+        if cache_path and os.path.isfile(cache_path):
+            logger.info('Loading cached tracks {}'.format(cache_path))
+            with np.load(cache_path) as cache:
+                arrays = dict(cache)
+        else:
+            arrays = self.build(all_files, delim, num_workers)
+            if cache_path:
+                logger.info('Caching tracks to {}'.format(cache_path))
+                save_cache(cache_path, **arrays)
+
+        self.traj = arrays['traj']
+        self.frame_idx = arrays['frame_idx']
+        self.run_len = arrays['run_len']
+        self.window_ids = arrays['window_ids']
+        self.window_order = arrays['window_order']
+        self.frame_ids = arrays['frame_ids']
+        self.file_ids = arrays['file_ids']
+
+    def build(self, all_files, delim, num_workers):
+        """
+        Output: Dict with the numpy arrays below, all in the row order of
+        sort_tracks with the files concatenated
+        - traj, frame_idx, run_len: See sort_tracks
+        - window_ids: Frame index made unique across files
+        - window_order: All rows ordered by window and then by ped_id
+        - frame_ids: Frame id of every row
+        - file_ids: Index in all_files of the file of every row
+        """
+        all_data = read_files(all_files, delim, num_workers=num_workers)
+        if not all_data:
+            raise ValueError('No dataset files to build tracks from')
+        columns = [[], [], [], [], [], [], []]
+        num_frames = 0
+        for file_id, data in enumerate(all_data):
+            frame_idx, ped_ids, traj, run_len = sort_tracks(data)
+            frame_ids = np.unique(data[:, 0])[frame_idx]
+            for column, value in zip(columns, (
+                frame_idx, ped_ids, traj, run_len, frame_idx + num_frames,
+                frame_ids, np.full(len(frame_idx), file_id, np.int32)
+            )):
+                column.append(value)
+            num_frames += frame_idx.max() + 1 if len(frame_idx) else 0
+        (frame_idx, ped_ids, traj, run_len, window_ids, frame_ids,
+         file_ids) = [np.concatenate(column) for column in columns]
+        return {
+            'traj': traj,
+            'frame_idx': frame_idx,
+            'run_len': run_len,
+            'window_ids': window_ids,
+            'window_order': np.lexsort((ped_ids, window_ids)),
+            'frame_ids': frame_ids,
+            'file_ids': file_ids,
+        }
+
+    def index(self, seq_len, skip, min_ped):
+        """
+        Input:
+        - seq_len: Number of frames in a window
+        - skip: Number of frames between the starts of two windows
+        - min_ped: Windows need more than min_ped complete tracks to be kept
+        Output:
+        - start_rows: Row of the first frame of every complete track, ordered
+        by window and then by ped_id
+        - num_peds_in_seq: Numpy array with the number of tracks in every
+        kept window
+        """
+        rows = self.window_order
+        start_rows = rows[(self.run_len[rows] >= seq_len) &
+                          (self.frame_idx[rows] % skip == 0)]
+        window_ids = self.window_ids[start_rows]
+        new_window = np.ones(len(start_rows), dtype=bool)
+        new_window[1:] = window_ids[1:] != window_ids[:-1]
+        num_peds = np.diff(
+            np.append(np.flatnonzero(new_window), len(start_rows)))
+        keep = num_peds > min_ped
+        start_rows = start_rows[np.repeat(keep, num_peds)]
+        return start_rows, num_peds[keep]
+
+    def index_all(self, configs, min_ped=1):
+        """
+        Input:
+        - configs: Iterable of (obs_len, pred_len, skip) tuples
+        - min_ped: See index
+        Output:
+        - index: Dict mapping every config to the output of index
+        """
+        return {
+            (obs_len, pred_len, skip): self.index(
+                obs_len + pred_len, skip, min_ped)
+            for obs_len, pred_len, skip in configs
+        }
+
+    def arrays(self, obs_len, pred_len, skip, threshold, min_ped):
+        """
+        Input:
+        - obs_len, pred_len, skip, threshold, min_ped: See TrajectoryDataset
+        Output: Dict with the numpy arrays
+        - traj: Shape (num_rows, 2). Positions of all files, sorted by file,
+        ped and frame
+        - traj_rel: Shape (num_rows, 2). Displacement from the previous row
+        - traj_fixed: Shape (num_rows, 2). traj in fixed point, as int32
+        multiples of 1 / FIXED_POINT_SCALE
+        - start_rows: Shape (num_peds, ). Row of the first frame of every ped
+        in every sequence, ordered by sequence
+        - non_linear_ped: Shape (num_peds, )
+        - num_peds_in_seq: Shape (num_seq, ). Number of peds in every sequence
+        - seq_file: Shape (num_seq, ). Index in all_files of the file of
+        every sequence
+        - seq_frame: Shape (num_seq, ). Frame id of the first frame
+        - seq_non_linear: Shape (num_seq, ). Fraction of non linear peds
+        - seq_bbox: Shape (num_seq, 4). x_min, y_min, x_max, y_max of all the
+        positions of the sequence
+        """
+        seq_len = obs_len + pred_len
+        start_rows, num_peds_in_seq = self.index(seq_len, skip, min_ped)
+        # Displacements are taken in float64 before the cast to float32 so
+        # they match differencing each window on its own.
+        traj_rel = np.zeros(self.traj.shape)
+        traj_rel[1:] = self.traj[1:] - self.traj[:-1]
+        # Linear vs Non-Linear Trajectory
+        windows = gather_windows(self.traj, start_rows, seq_len)
+        non_linear_ped = non_linear_flags(windows, pred_len, threshold)
+
+        # Scene metadata, reduced over the peds of every sequence
+        seq_starts = np.cumsum(num_peds_in_seq) - num_peds_in_seq
+        seq_bbox = np.zeros((len(seq_starts), 4), np.float32)
+        seq_non_linear = np.zeros(len(seq_starts), np.float32)
+        if len(seq_starts):
+            seq_bbox[:, :2] = np.minimum.reduceat(
+                windows.min(axis=2), seq_starts)
+            seq_bbox[:, 2:] = np.maximum.reduceat(
+                windows.max(axis=2), seq_starts)
+            seq_non_linear[:] = np.add.reduceat(
+                non_linear_ped, seq_starts) / num_peds_in_seq
+        first_rows = start_rows[seq_starts]
+        return {
+            'traj': self.traj.astype(np.float32),
+            'traj_rel': traj_rel.astype(np.float32),
+            'traj_fixed': np.rint(
+                self.traj * FIXED_POINT_SCALE).astype(np.int32),
+            'start_rows': start_rows.astype(np.int64),
+            'non_linear_ped': non_linear_ped,
+            'num_peds_in_seq': num_peds_in_seq.astype(np.int64),
+            'seq_file': self.file_ids[first_rows],
+            'seq_frame': self.frame_ids[first_rows],
+            'seq_non_linear': seq_non_linear,
+            'seq_bbox': seq_bbox,
+        }
+
+
+def _file_arrays(path, cache_path, delim, *args):
+    """Arrays of TrackStore.arrays for one file, through its cache"""
+    if os.path.isfile(cache_path):
+        with np.load(cache_path) as cache:
+            return dict(cache)
+    cache_dir = os.path.dirname(cache_path)
+    arrays = TrackStore([path], delim, cache_dir=cache_dir).arrays(*args)
+    save_cache(cache_path, **arrays)
+    return arrays
+
+
+def _file_arrays_star(args):
+    return _file_arrays(*args)
+
+
+def file_arrays(
+    all_files, cache_dir, obs_len, pred_len, skip, threshold, min_ped,
+    delim='\t', num_workers=0
+):
+    """
+    Input:
+    - all_files: Paths of the dataset files
+    - cache_dir: Directory of the per file caches
+    - obs_len, pred_len, skip, threshold, min_ped, delim: See
+    TrajectoryDataset
+    - num_workers: Number of processes building files in parallel
+    Output:
+    - arrays: Same as TrackStore(all_files).arrays(...), built file by file
+    and concatenated. Every file is cached under its content, so splits that
+    share files (such as the leave-one-out splits) build each file once.
+    """
+    jobs = []
+    for path in all_files:
+        key = cache_key(
+            [path], obs_len, pred_len, skip, threshold, min_ped, delim)
+        jobs.append((
+            path, os.path.join(cache_dir, key + '.npz'), delim, obs_len,
+            pred_len, skip, threshold, min_ped))
+    num_missing = sum(not os.path.isfile(job[1]) for job in jobs)
+    if num_workers > 0 and num_missing > 1:
+        with multiprocessing.Pool(min(num_workers, num_missing)) as pool:
+            parts = pool.map(_file_arrays_star, jobs)
+    else:
+        parts = [_file_arrays_star(job) for job in jobs]
+    logger.info('Built {} of {} files, loaded the others from {}'.format(
+        num_missing, len(jobs), cache_dir))
+
+    # Rows of every file come after the rows of the previous files
+    num_rows = np.cumsum([0] + [len(part['traj']) for part in parts])
+    arrays = {
+        name: np.concatenate([part[name] for part in parts])
+        for name in parts[0]
+    }
+    arrays['start_rows'] = np.concatenate([
+        part['start_rows'] + offset
+        for part, offset in zip(parts, num_rows)
+    ])
+    arrays['seq_file'] = np.concatenate([
+        np.full(len(part['seq_file']), file_id, np.int32)
+        for file_id, part in enumerate(parts)
+    ])
+    return arrays
+
+
 class TrajectoryDataset(Dataset):
     """Dataloader for the Trajectory datasets"""
     def __init__(
         self, data_dir, obs_len=8, pred_len=12, skip=1, threshold=0.002,
-        min_ped=1, delim='\t'
+        min_ped=1, delim='\t', cache_dir=None, num_workers=0, lazy=False,
+        store=None, compact=False
     ):
         """
         Args:
         - data_dir: Directory containing dataset files in the format
-        <frame_id> <ped_id> <x> <y>
+        <frame_id> <ped_id> <x> <y>, or the manifest of a split (see
+        MANIFEST_EXT)
         - obs_len: Number of time-steps in input trajectories
         - pred_len: Number of time-steps in output trajectories
         - skip: Number of frames to skip while making the dataset
@@ -84,6 +803,20 @@ class TrajectoryDataset(Dataset):
         when using a linear predictor
         - min_ped: Minimum number of pedestrians that should be in a seqeunce
         - delim: Delimiter in the dataset files
+        - cache_dir: Directory where the built tensors are cached, keyed by
+        the content of the dataset files and the arguments above. Every file
+        is also cached on its own, so a new split made of known files is
+        only concatenated. None disables the cache.
+        - num_workers: Number of processes parsing the dataset files
+        - lazy: Keep only the pedestrian tracks and the window start of every
+        ped and slice sequences out of them in __getitem__, instead of
+        storing every (overlapping) window
+        - store: TrackStore of the files in data_dir, shared between datasets
+        with different obs_len, pred_len or skip. Built when not given.
+        - compact: Lazy dataset that stores the tracks once, in fixed point,
+        and non_linear_ped as uint8. Displacements and loss_mask are made
+        when sequences are gathered. Batches are identical to the other
+        modes.
         """
         super(TrajectoryDataset, self).__init__()
 
@@ -93,69 +826,76 @@ class TrajectoryDataset(Dataset):
         self.skip = skip
         self.seq_len = self.obs_len + self.pred_len
         self.delim = delim
+        self.lazy = lazy or compact
+        self.compact = compact
 
-        all_files = os.listdir(self.data_dir)
-        all_files = [os.path.join(self.data_dir, _path) for _path in all_files]
-        num_peds_in_seq = []
-        seq_list = []
-        seq_list_rel = []
-        loss_mask_list = []
-        non_linear_ped = []
-        for path in all_files:
-            data = read_file(path, delim)
-            frames = np.unique(data[:, 0]).tolist()
-            frame_data = []
-            for frame in frames:
-                frame_data.append(data[frame == data[:, 0], :])
-            num_sequences = int(
-                math.ceil((len(frames) - self.seq_len + 1) / skip))
-
-            for idx in range(0, num_sequences * self.skip + 1, skip):
-                curr_seq_data = np.concatenate(
-                    frame_data[idx:idx + self.seq_len], axis=0)
-                peds_in_curr_seq = np.unique(curr_seq_data[:, 1])
-                curr_seq_rel = np.zeros((len(peds_in_curr_seq), 2,
-                                         self.seq_len))
-                curr_seq = np.zeros((len(peds_in_curr_seq), 2, self.seq_len))
-                curr_loss_mask = np.zeros((len(peds_in_curr_seq),
-                                           self.seq_len))
-                num_peds_considered = 0
-                _non_linear_ped = []
-                for _, ped_id in enumerate(peds_in_curr_seq):
-                    curr_ped_seq = curr_seq_data[curr_seq_data[:, 1] ==
-                                                 ped_id, :]
-                    curr_ped_seq = np.around(curr_ped_seq, decimals=4)
-                    pad_front = frames.index(curr_ped_seq[0, 0]) - idx
-                    pad_end = frames.index(curr_ped_seq[-1, 0]) - idx + 1
-                    if pad_end - pad_front != self.seq_len:
-                        continue
-                    curr_ped_seq = np.transpose(curr_ped_seq[:, 2:])
-                    curr_ped_seq = curr_ped_seq
-                    # Make coordinates relative
-                    rel_curr_ped_seq = np.zeros(curr_ped_seq.shape)
-                    rel_curr_ped_seq[:, 1:] = \
-                        curr_ped_seq[:, 1:] - curr_ped_seq[:, :-1]
-                    _idx = num_peds_considered
-                    curr_seq[_idx, :, pad_front:pad_end] = curr_ped_seq
-                    curr_seq_rel[_idx, :, pad_front:pad_end] = rel_curr_ped_seq
-                    # Linear vs Non-Linear Trajectory
-                    _non_linear_ped.append(
-                        poly_fit(curr_ped_seq, pred_len, threshold))
-                    curr_loss_mask[_idx, pad_front:pad_end] = 1
-                    num_peds_considered += 1
-
-                if num_peds_considered > min_ped:
-                    non_linear_ped += _non_linear_ped
-                    num_peds_in_seq.append(num_peds_considered)
-                    loss_mask_list.append(curr_loss_mask[:num_peds_considered])
-                    seq_list.append(curr_seq[:num_peds_considered])
-                    seq_list_rel.append(curr_seq_rel[:num_peds_considered])
-
-        self.num_seq = len(seq_list)
-        seq_list = np.concatenate(seq_list, axis=0)
-        seq_list_rel = np.concatenate(seq_list_rel, axis=0)
-        loss_mask_list = np.concatenate(loss_mask_list, axis=0)
-        non_linear_ped = np.asarray(non_linear_ped)
+        if store is not None:
+            all_files = store.all_files
+            file_names = [os.path.basename(_path) for _path in all_files]
+        else:
+            all_files, file_names = list_files(self.data_dir, names=True)
+        self.file_names = file_names
+
+        cache_path = None
+        if cache_dir:
+            key = cache_key(
+                all_files, obs_len, pred_len, skip, threshold, min_ped, delim)
+            cache_path = os.path.join(cache_dir, key + '.npz')
+        if cache_path and os.path.isfile(cache_path):
+            logger.info('Loading cached dataset {}'.format(cache_path))
+            with np.load(cache_path) as cache:
+                arrays = dict(cache)
+        else:
+            if store is None and cache_dir:
+                arrays = file_arrays(
+                    all_files, cache_dir, obs_len, pred_len, skip, threshold,
+                    min_ped, delim, num_workers=num_workers)
+            else:
+                if store is None:
+                    store = TrackStore(
+                        all_files, delim, num_workers=num_workers)
+                arrays = store.arrays(
+                    obs_len, pred_len, skip, threshold, min_ped)
+            if cache_path:
+                logger.info('Caching dataset to {}'.format(cache_path))
+                save_cache(cache_path, **arrays)
+
+        num_peds_in_seq = arrays['num_peds_in_seq'].tolist()
+        self.num_seq = len(num_peds_in_seq)
+        self.non_linear_ped = torch.from_numpy(arrays['non_linear_ped'])
+        self.non_linear_ped = self.non_linear_ped.type(
+            torch.uint8 if self.compact else torch.float)
+        cum_start_idx = [0] + np.cumsum(num_peds_in_seq).tolist()
+        self.seq_start_end = [
+            (start, end)
+            for start, end in zip(cum_start_idx, cum_start_idx[1:])
+        ]
+        # Columns of per sequence metadata, see SceneIndex
+        self.scene_meta = {
+            'file': arrays['seq_file'],
+            'frame': arrays['seq_frame'],
+            'num_peds': arrays['num_peds_in_seq'],
+            'non_linear': arrays['seq_non_linear'],
+            'bbox': arrays['seq_bbox'],
+        }
+
+        if self.compact:
+            self.traj_fixed = torch.from_numpy(arrays['traj_fixed'])
+        elif self.lazy:
+            self.traj = torch.from_numpy(arrays['traj'])
+            self.traj_rel = torch.from_numpy(arrays['traj_rel'])
+        if self.lazy:
+            self.start_rows = torch.from_numpy(arrays['start_rows'])
+            self.seq_rows = torch.arange(self.seq_len)
+            self.rel_rows = torch.arange(-1, self.seq_len)
+            return
+
+        seq_list = np.ascontiguousarray(gather_windows(
+            arrays['traj'], arrays['start_rows'], self.seq_len))
+        seq_list_rel = np.ascontiguousarray(gather_windows(
+            arrays['traj_rel'], arrays['start_rows'], self.seq_len))
+        seq_list_rel[:, :, 0] = 0
+        loss_mask_list = np.ones((len(seq_list), self.seq_len), np.float32)
 
         # Convert numpy -> Torch Tensor
         self.obs_traj = torch.from_numpy(
@@ -167,21 +907,280 @@ class TrajectoryDataset(Dataset):
         self.pred_traj_rel = torch.from_numpy(
             seq_list_rel[:, :, self.obs_len:]).type(torch.float)
         self.loss_mask = torch.from_numpy(loss_mask_list).type(torch.float)
-        self.non_linear_ped = torch.from_numpy(non_linear_ped).type(torch.float)
-        cum_start_idx = [0] + np.cumsum(num_peds_in_seq).tolist()
-        self.seq_start_end = [
-            (start, end)
-            for start, end in zip(cum_start_idx, cum_start_idx[1:])
-        ]
 
     def __len__(self):
         return self.num_seq
 
     def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.get_block(index)
         start, end = self.seq_start_end[index]
+        if self.lazy:
+            out = self.gather(slice(start, end), None, SEQ_FIELDS[:-1])
+            # Back to batch, input_size, seq_len
+            return [
+                tensor.permute(1, 2, 0) if tensor.dim() == 3 else tensor
+                for tensor in out
+            ]
         out = [
             self.obs_traj[start:end, :], self.pred_traj[start:end, :],
             self.obs_traj_rel[start:end, :], self.pred_traj_rel[start:end, :],
             self.non_linear_ped[start:end], self.loss_mask[start:end, :]
         ]
         return out
+
+    def get_block(self, block):
+        """
+        Input:
+        - block: slice of consecutive sequence indices, with step 1
+        Output:
+        - The batch seq_collate makes from these sequences, in SEQ_FIELDS
+        order. Pedestrians of consecutive sequences are contiguous, so
+        the tensors are views of the dataset instead of copies (lazy
+        datasets gather the windows of the block in one indexing op).
+        """
+        first, last, step = block.indices(self.num_seq)
+        if step != 1:
+            raise ValueError('Blocks must be contiguous, got step %d' % step)
+        if last <= first:
+            raise IndexError('Empty block %s' % (block, ))
+        seq_start_end = torch.LongTensor(self.seq_start_end[first:last])
+        start = self.seq_start_end[first][0]
+        end = self.seq_start_end[last - 1][1]
+        seq_start_end -= start
+        return self.gather(slice(start, end), seq_start_end)
+
+    def gather(self, peds, seq_start_end, fields=SEQ_FIELDS):
+        """
+        Input:
+        - peds: Pedestrians of the batch, as a slice (tensors are views) or
+        a LongTensor (tensors are gathered with one indexing op per field)
+        - seq_start_end: LongTensor of shape (batch, 2) of the sequences
+        within peds
+        - fields: Names from SEQ_FIELDS to return
+        Output:
+        - Tuple of the fields of the batch, as seq_collate makes them
+        """
+        start_rows = self.start_rows[peds, None] if self.lazy else None
+        num_peds = len(self.non_linear_ped[peds])
+        # Lazy windows of positions (False) and displacements (True)
+        seqs = {}
+        out = []
+        for name in fields:
+            if name == 'seq_start_end':
+                out.append(seq_start_end)
+            elif name == 'non_linear_ped':
+                out.append(self.non_linear_ped[peds].type(torch.float))
+            elif name == 'loss_mask':
+                out.append(
+                    torch.ones(num_peds, self.seq_len) if self.lazy
+                    else self.loss_mask[peds])
+            elif self.lazy:
+                rel = name.endswith('_rel')
+                if rel not in seqs:
+                    seqs[rel] = self.windows(start_rows, rel)
+                    if rel:
+                        seqs[rel][:, 0] = 0
+                if name.startswith('obs'):
+                    seq = seqs[rel][:, :self.obs_len]
+                else:
+                    seq = seqs[rel][:, self.obs_len:]
+                out.append(seq.permute(1, 0, 2))
+            else:
+                # Data format: batch, input_size, seq_len
+                # LSTM input format: seq_len, batch, input_size
+                out.append(getattr(self, name)[peds].permute(2, 0, 1))
+        return tuple(out)
+
+    def windows(self, start_rows, rel=False):
+        """
+        Input:
+        - start_rows: LongTensor of shape (num_peds, 1). First row of the
+        window of every ped in the tracks of a lazy dataset
+        - rel: Return displacements instead of positions
+        Output:
+        - Float tensor of shape (num_peds, seq_len, 2)
+        """
+        if not self.compact:
+            traj = self.traj_rel if rel else self.traj
+            return traj[start_rows + self.seq_rows]
+        if not rel:
+            traj = self.traj_fixed[start_rows + self.seq_rows]
+            return (traj.type(torch.double) / FIXED_POINT_SCALE).type(
+                torch.float)
+        # Positions from the row before the window on, differenced with the
+        # same float64 ops as TrackStore.arrays so the values are the same
+        traj = self.traj_fixed[start_rows + self.rel_rows]
+        traj = traj.type(torch.double) / FIXED_POINT_SCALE
+        return (traj[:, 1:] - traj[:, :-1]).type(torch.float)
+
+    def share_memory(self):
+        """Moves the tensors of the dataset to shared memory, so DataLoader
+        workers and other processes use them without copies"""
+        for tensor in vars(self).values():
+            if torch.is_tensor(tensor):
+                tensor.share_memory_()
+        return self
+
+
+class SeqRanges(Dataset):
+    """Pedestrian ranges of the sequences of a TrajectoryDataset. DataLoader
+    workers batch these with seq_range_collate and the process that owns the
+    (shared) dataset gathers the tensors, so only indices go through the
+    worker queues."""
+    def __init__(self, seq_start_end):
+        super(SeqRanges, self).__init__()
+        self.seq_start_end = seq_start_end
+
+    def __len__(self):
+        return len(self.seq_start_end)
+
+    def __getitem__(self, index):
+        return self.seq_start_end[index]
+
+
+def seq_range_collate(data):
+    """
+    Input:
+    - data: List of (start, end) pedestrian ranges of sequences
+    Output:
+    - peds: LongTensor of the pedestrians of the batch
+    - seq_start_end: LongTensor of shape (batch, 2) within peds
+    """
+    start, end = np.array(data, dtype=np.int64).reshape(-1, 2).T
+    _len = end - start
+    cum_start_idx = np.concatenate([[0], np.cumsum(_len)])
+    peds = np.repeat(start - cum_start_idx[:-1], _len) + \
+        np.arange(cum_start_idx[-1])
+    seq_start_end = np.stack([cum_start_idx[:-1], cum_start_idx[1:]], 1)
+    return torch.from_numpy(peds), torch.from_numpy(seq_start_end)
+
+
+class StreamingTrajectoryDataset(IterableDataset):
+    """Streams the sequences of TrajectoryDataset from files sorted by frame,
+    holding only seq_len frames per file (plus the shuffle buffer) in
+    memory"""
+    def __init__(
+        self, data_dir, obs_len=8, pred_len=12, skip=1, threshold=0.002,
+        min_ped=1, delim='\t', chunk_frames=1000, shuffle_buffer=0,
+        seed=None
+    ):
+        """
+        Args:
+        - data_dir, obs_len, pred_len, skip, threshold, min_ped, delim: See
+        TrajectoryDataset
+        - chunk_frames: Sequences are split between DataLoader workers in
+        blocks of chunk_frames start frames. Workers seek straight to their
+        blocks in binary files and skip the others while reading text files.
+        - shuffle_buffer: Number of sequences held back and yielded in random
+        order. 0 keeps the order of TrajectoryDataset.
+        - seed: Seed of the shuffle buffer, offset by the worker id
+        """
+        super(StreamingTrajectoryDataset, self).__init__()
+
+        self.data_dir = data_dir
+        self.obs_len = obs_len
+        self.pred_len = pred_len
+        self.skip = skip
+        self.seq_len = self.obs_len + self.pred_len
+        self.threshold = threshold
+        self.min_ped = min_ped
+        self.delim = delim
+        self.chunk_frames = chunk_frames
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+
+        self.all_files = list_files(self.data_dir)
+
+    def owner(self, file_idx, seq_start, num_workers):
+        """Worker that yields the sequence starting at frame seq_start"""
+        return (file_idx + seq_start // self.chunk_frames) % num_workers
+
+    def frame_ranges(self, file_idx, worker_id, num_workers):
+        """Frame ranges of a file to read to see every block of the worker"""
+        path = self.all_files[file_idx]
+        if num_workers == 1 or not is_binary(path):
+            return [(0, None)]
+        num_frames = len(read_binary(path)['frames'])
+        return [
+            (start, start + self.chunk_frames + self.seq_len - 1)
+            for start in range(0, num_frames, self.chunk_frames)
+            if self.owner(file_idx, start, num_workers) == worker_id
+        ]
+
+    def sequences(self, worker_id, num_workers):
+        for file_idx, path in enumerate(self.all_files):
+            ranges = self.frame_ranges(file_idx, worker_id, num_workers)
+            for start, stop in ranges:
+                frames = collections.deque(maxlen=self.seq_len)
+                for frame_idx, rows in iter_frames(
+                    path, self.delim, start, stop
+                ):
+                    frames.append(rows)
+                    seq_start = frame_idx - self.seq_len + 1
+                    if (
+                        seq_start < 0 or seq_start % self.skip != 0 or
+                        self.owner(file_idx, seq_start, num_workers) !=
+                        worker_id
+                    ):
+                        continue
+                    out = self.make_sequence(np.concatenate(frames))
+                    if out is not None:
+                        yield out
+
+    def make_sequence(self, data):
+        """
+        Input:
+        - data: Numpy array with the rows of seq_len consecutive frames
+        Output:
+        - The items TrajectoryDataset.__getitem__ returns for the sequence
+        starting at the first frame, or None if it has too few peds
+        """
+        frame_idx, _, traj, run_len = sort_tracks(data)
+        start_rows = np.flatnonzero((frame_idx == 0) &
+                                    (run_len >= self.seq_len))
+        if len(start_rows) <= self.min_ped:
+            return None
+        curr_seq = gather_windows(traj, start_rows, self.seq_len)
+        curr_seq_rel = np.zeros(curr_seq.shape)
+        curr_seq_rel[:, :, 1:] = np.diff(curr_seq, axis=2)
+        non_linear_ped = non_linear_flags(
+            curr_seq, self.pred_len, self.threshold)
+        curr_seq = torch.from_numpy(curr_seq).type(torch.float)
+        curr_seq_rel = torch.from_numpy(curr_seq_rel).type(torch.float)
+        out = [
+            curr_seq[:, :, :self.obs_len], curr_seq[:, :, self.obs_len:],
+            curr_seq_rel[:, :, :self.obs_len],
+            curr_seq_rel[:, :, self.obs_len:],
+            torch.from_numpy(non_linear_ped),
+            torch.ones(len(start_rows), self.seq_len)
+        ]
+        return out
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = 0, 1
+        if worker_info is not None:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+        sequences = self.sequences(worker_id, num_workers)
+        if not self.shuffle_buffer:
+            return sequences
+        seed = None if self.seed is None else self.seed + worker_id
+        return shuffle_buffer(sequences, self.shuffle_buffer, seed)
+
+
+def shuffle_buffer(iterable, buffer_size, seed=None):
+    """Yield the items of iterable in a random order, keeping at most
+    buffer_size of them in memory"""
+    rng = random.Random(seed)
+    buf = []
+    for item in iterable:
+        if len(buf) < buffer_size:
+            buf.append(item)
+            continue
+        idx = rng.randrange(buffer_size)
+        yield buf[idx]
+        buf[idx] = item
+    rng.shuffle(buf)
+    for item in buf:
+        yield item
@@ -117,3 +117,46 @@ def final_displacement_error(
         return loss
     else:
         return torch.sum(loss)
+
+
+# Order of the sums returned by trajectory_metrics
+TRAJECTORY_METRICS = (
+    'ade', 'ade_l', 'ade_nl', 'fde', 'fde_l', 'fde_nl', 'g_l2_loss_abs',
+    'g_l2_loss_rel'
+)
+
+
+def trajectory_metrics(
+    pred_traj, pred_traj_gt, pred_traj_rel, pred_traj_gt_rel, loss_mask,
+    non_linear_ped
+):
+    """
+    Input:
+    - pred_traj, pred_traj_gt: Tensors of shape (seq_len, batch, 2).
+    Predicted and ground truth trajectories.
+    - pred_traj_rel, pred_traj_gt_rel: Tensors of shape (seq_len, batch, 2).
+    Predicted and ground truth displacements.
+    - loss_mask: Tensor of shape (batch, seq_len)
+    - non_linear_ped: Tensor of shape (batch)
+    Output:
+    - metrics: Tensor of shape (8, ). In TRAJECTORY_METRICS order, the sums
+    of displacement_error and final_displacement_error over all, linear and
+    non linear peds, and l2_loss in sum mode of the trajectories and of the
+    displacements. The squared differences are computed once.
+    """
+    sq_error = (pred_traj_gt - pred_traj)**2
+    sq_error_rel = (pred_traj_gt_rel - pred_traj_rel)**2
+    # Distance of every ped at every step
+    dist = torch.sqrt(sq_error.sum(dim=2))
+    peds = torch.stack(
+        [torch.ones_like(non_linear_ped), 1 - non_linear_ped,
+         non_linear_ped]).to(dist)
+    loss_mask = loss_mask.t().unsqueeze(dim=2)
+    return torch.cat([
+        (dist.sum(dim=0) * peds).sum(dim=1),
+        (dist[-1] * peds).sum(dim=1),
+        torch.stack([
+            torch.sum(loss_mask * sq_error),
+            torch.sum(loss_mask * sq_error_rel)
+        ])
+    ])
@@ -1,6 +1,9 @@
+import numpy as np
 import torch
 import torch.nn as nn
 
+from sgan.utils import segment_broadcast
+
 
 def make_mlp(dim_list, activation='relu', batch_norm=True, dropout=0):
     layers = []
@@ -17,14 +20,241 @@ def make_mlp(dim_list, activation='relu', batch_norm=True, dropout=0):
     return nn.Sequential(*layers)
 
 
-def get_noise(shape, noise_type):
+def get_noise(shape, noise_type, device=None, dtype=None):
     if noise_type == 'gaussian':
-        return torch.randn(*shape).cuda()
+        return torch.randn(*shape, device=device, dtype=dtype)
     elif noise_type == 'uniform':
-        return torch.rand(*shape).sub_(0.5).mul_(2.0).cuda()
+        return torch.rand(
+            *shape, device=device, dtype=dtype).sub_(0.5).mul_(2.0)
     raise ValueError('Unrecognized noise type "%s"' % noise_type)
 
 
+def scene_pairs(seq_start_end):
+    """
+    Inputs:
+    - seq_start_end: Tensor of shape (num_seq, 2) which delimits sequences
+    within batch
+    Output: Dict with all the ordered pairs (i, j) of peds of the same
+    sequence, sequences sorted by size so that the pairs of every size
+    are contiguous, i-major with j varying fastest
+    - ped_i, ped_j: LongTensors of shape (num_pairs, ), on the device of
+    seq_start_end
+    - groups: List of (num_ped, num_seq) of the sequences of every size
+    - seq_order: LongTensor of shape (num_seq, ). Index in seq_start_end of
+    every sequence, in pair order
+    - out_rows: LongTensor of shape (batch, ). Row of the output of the
+    per-sequence loop (sequences concatenated in order) of every ped i,
+    in pair order
+    - peds: LongTensor of shape (batch, ). Index in batch of every ped i, in
+    pair order
+    """
+    bounds = np.array(seq_start_end.tolist(), dtype=np.int64).reshape(-1, 2)
+    num_peds = bounds[:, 1] - bounds[:, 0]
+    order = np.argsort(num_peds, kind='stable')
+    sizes, starts = num_peds[order], bounds[order, 0]
+    out_starts = (np.cumsum(num_peds) - num_peds)[order]
+
+    num_pairs = sizes ** 2
+    pair_size = np.repeat(sizes, num_pairs)
+    pair_idx = np.arange(num_pairs.sum()) - np.repeat(
+        np.cumsum(num_pairs) - num_pairs, num_pairs)
+    pair_start = np.repeat(starts, num_pairs)
+    ped_idx = np.arange(sizes.sum()) - np.repeat(
+        np.cumsum(sizes) - sizes, sizes)
+    sizes_unique, counts = np.unique(sizes, return_counts=True)
+
+    device = seq_start_end.device
+    return {
+        'ped_i': torch.from_numpy(
+            pair_start + pair_idx // pair_size).to(device),
+        'ped_j': torch.from_numpy(
+            pair_start + pair_idx % pair_size).to(device),
+        'seq_order': torch.from_numpy(order).to(device),
+        'groups': list(zip(sizes_unique.tolist(), counts.tolist())),
+        'out_rows': torch.from_numpy(
+            np.repeat(out_starts, sizes) + ped_idx).to(device),
+        'peds': torch.from_numpy(
+            np.repeat(starts, sizes) + ped_idx).to(device),
+    }
+
+
+def neighbor_pairs(
+    seq_start_end, end_pos, radius, norm=2, include_self=False
+):
+    """
+    Pairs (i, j) of peds of the same sequence with j within radius of i,
+    found with a spatial hash: the end positions are binned into square
+    cells of side radius, and only the peds of the 3 x 3 cells around the
+    cell of i are candidates for j.
+    Inputs:
+    - seq_start_end: Tensor of shape (num_seq, 2) which delimits sequences
+    within batch
+    - end_pos: Tensor of shape (batch, 2)
+    - radius: Distance from i of the peds j to keep. A pair whose distance is
+    radius up to the rounding of end_pos is kept.
+    - norm: 2 for the disk of radius around i, float('inf') for the square
+    of side 2 * radius
+    - include_self: Whether to include the pairs (i, i)
+    Output:
+    - ped_i, ped_j: LongTensors of shape (num_pairs, ), on the device of
+    end_pos, sorted by i then j
+    """
+    bounds = np.array(seq_start_end.tolist(), dtype=np.int64).reshape(-1, 2)
+    num_peds = bounds[:, 1] - bounds[:, 0]
+    total = num_peds.sum()
+    peds = np.repeat(bounds[:, 0], num_peds) + np.arange(total) - np.repeat(
+        np.cumsum(num_peds) - num_peds, num_peds)
+    seq = np.repeat(np.arange(len(bounds)), num_peds)
+    pos = end_pos.detach().cpu().numpy()[peds]
+    # One ulp of the largest coordinate covers the rounding of end_pos
+    tol = 2 * float(np.spacing(pos.dtype.type(np.abs(pos).max() + radius)))
+    pos = pos.astype(np.float64)
+
+    cell = np.floor(pos / (radius + tol)).astype(np.int64)
+    # From 1 so that the neighboring cells are never negative
+    cell = cell - cell.min(0) + 1
+    dims = cell.max(0) + 2
+    key = (seq * dims[0] + cell[:, 0]) * dims[1] + cell[:, 1]
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    ped_i, ped_j = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            target = key + dx * dims[1] + dy
+            first = np.searchsorted(sorted_key, target, side='left')
+            counts = np.searchsorted(sorted_key, target, side='right') - first
+            offsets = np.arange(counts.sum()) - np.repeat(
+                np.cumsum(counts) - counts, counts)
+            ped_i.append(np.repeat(np.arange(total), counts))
+            ped_j.append(order[np.repeat(first, counts) + offsets])
+    ped_i, ped_j = np.concatenate(ped_i), np.concatenate(ped_j)
+
+    dist = np.linalg.norm(pos[ped_j] - pos[ped_i], ord=norm, axis=1)
+    keep = dist <= radius + tol
+    if not include_self:
+        keep &= ped_i != ped_j
+    ped_i, ped_j = ped_i[keep], ped_j[keep]
+    order = np.lexsort((ped_j, ped_i))
+    device = end_pos.device
+    return (
+        torch.from_numpy(peds[ped_i[order]]).to(device),
+        torch.from_numpy(peds[ped_j[order]]).to(device),
+    )
+
+
+def pair_max(pairs, ped_i, batch):
+    """
+    Inputs:
+    - pairs: Tensor of shape (num_pairs, dim)
+    - ped_i: LongTensor of shape (num_pairs, ). Ped i of every pair, sorted,
+    with at least one pair for every ped
+    - batch: Number of peds
+    Output:
+    - Tensor of shape (batch, dim). Max over the pairs of every ped i, the
+    first pair of i on ties
+    """
+    counts = torch.bincount(ped_i, minlength=batch)
+    starts = torch.cumsum(counts, 0) - counts
+    slot = torch.arange(ped_i.size(0), device=ped_i.device) - starts[ped_i]
+    padded = pairs.new_full(
+        (batch, int(counts.max()), pairs.size(1)), float('-inf'))
+    padded = padded.index_put((ped_i, slot), pairs)
+    return padded.max(1)[0]
+
+
+def segment_batch_norm(layer, x, segments, segment_order):
+    """
+    Batch norm in training mode with statistics per segment, as if layer
+    were called on every segment in turn (running statistics included)
+    Inputs:
+    - layer: nn.BatchNorm1d in training mode
+    - x: Tensor of shape (num_rows, num_features)
+    - segments: List of (length, count): the rows of x are count segments of
+    length rows, then the segments of the next entry, ...
+    - segment_order: LongTensor of shape (num_segments, ). Position of every
+    segment in the order of the calls
+    """
+    out, means, variances = [], [], []
+    # split rather than slicing, whose backward fills a gradient of the size
+    # of x for every slice
+    blocks = x.split([length * count for length, count in segments])
+    for (length, count), rows in zip(segments, blocks):
+        rows = rows.view(count, length, -1)
+        mean = rows.mean(1, keepdim=True)
+        centered = rows - mean
+        var = (centered * centered).mean(1, keepdim=True)
+        out.append((centered / torch.sqrt(var + layer.eps)).view(
+            length * count, -1))
+        means.append(mean.squeeze(1))
+        # A segment of one row has no unbiased variance: keep the biased one
+        # (0) rather than writing nan into the running variance
+        variances.append(var.squeeze(1) * length / max(length - 1, 1))
+    out = torch.cat(out, dim=0)
+    if layer.affine:
+        out = out * layer.weight + layer.bias
+    if layer.track_running_stats:
+        with torch.no_grad():
+            update_running_stats(
+                layer, torch.cat(means), torch.cat(variances), segment_order)
+    return out
+
+
+def update_running_stats(layer, means, variances, segment_order):
+    """Running statistics of a batch norm layer after one call per segment,
+    in segment_order, with the given means and unbiased variances"""
+    num_segments = len(means)
+    tracked = layer.num_batches_tracked.item()
+    layer.num_batches_tracked += num_segments
+    if layer.momentum is None:
+        # Cumulative moving average over all calls
+        weights = means.new_full((num_segments, 1), 1.)
+        keep = tracked
+        total = tracked + num_segments
+    else:
+        # Exponential moving average, one update per call
+        momentum = layer.momentum
+        weights = momentum * (1 - momentum) ** (
+            num_segments - 1 - segment_order.type_as(means))[:, None]
+        keep = (1 - momentum) ** num_segments
+        total = 1.
+    layer.running_mean.mul_(keep).add_((weights * means).sum(0)).div_(total)
+    layer.running_var.mul_(keep).add_(
+        (weights * variances).sum(0)).div_(total)
+
+
+def segment_mlp(mlp, x, segments, segment_order):
+    """
+    Applies a make_mlp Sequential to the rows of x in one pass, with the
+    results of calling it on every segment of rows in turn: batch norm
+    layers in training mode normalize every segment on its own. See
+    segment_batch_norm for segments and segment_order.
+    """
+    for layer in mlp:
+        if isinstance(layer, nn.BatchNorm1d) and layer.training:
+            x = segment_batch_norm(layer, x, segments, segment_order)
+        else:
+            x = layer(x)
+    return x
+
+
+def group_max(pairs, groups):
+    """
+    Inputs:
+    - pairs: Tensor of shape (num_pairs, dim) in the order of scene_pairs
+    - groups: groups of scene_pairs
+    Output:
+    - Tensor of shape (batch, dim). Max over j of every ped i, in pair
+    order. Max is taken like the per-sequence loop does, so gradients go
+    to the same pair on ties.
+    """
+    blocks = pairs.split([
+        num_seq * num_ped * num_ped for num_ped, num_seq in groups])
+    return torch.cat([
+        group.view(num_seq * num_ped, num_ped, -1).max(1)[0]
+        for (num_ped, num_seq), group in zip(groups, blocks)
+    ], dim=0)
+
+
 class Encoder(nn.Module):
     """Encoder is part of both TrajectoryGenerator and
     TrajectoryDiscriminator"""
@@ -46,9 +276,11 @@ class Encoder(nn.Module):
         self.spatial_embedding = nn.Linear(2, embedding_dim)
 
     def init_hidden(self, batch):
+        # On the device and in the dtype of the parameters
+        weight = self.spatial_embedding.weight
         return (
-            torch.zeros(self.num_layers, batch, self.h_dim).cuda(),
-            torch.zeros(self.num_layers, batch, self.h_dim).cuda()
+            weight.new_zeros((self.num_layers, batch, self.h_dim)),
+            weight.new_zeros((self.num_layers, batch, self.h_dim))
         )
 
     def forward(self, obs_traj):
@@ -60,7 +292,7 @@ class Encoder(nn.Module):
         """
         # Encode observed Trajectory
         batch = obs_traj.size(1)
-        obs_traj_embedding = self.spatial_embedding(obs_traj.view(-1, 2))
+        obs_traj_embedding = self.spatial_embedding(obs_traj.reshape(-1, 2))
         obs_traj_embedding = obs_traj_embedding.view(
             -1, batch, self.embedding_dim
         )
@@ -76,7 +308,9 @@ class Decoder(nn.Module):
         self, seq_len, embedding_dim=64, h_dim=128, mlp_dim=1024, num_layers=1,
         pool_every_timestep=True, dropout=0.0, bottleneck_dim=1024,
         activation='relu', batch_norm=True, pooling_type='pool_net',
-        neighborhood_size=2.0, grid_size=8
+        neighborhood_size=2.0, grid_size=8, pool_factorized=False,
+        pool_chunk_size=0, pool_memory_budget=0, pool_radius=0,
+        neighbor_search=False
     ):
         super(Decoder, self).__init__()
 
@@ -99,7 +333,11 @@ class Decoder(nn.Module):
                     bottleneck_dim=bottleneck_dim,
                     activation=activation,
                     batch_norm=batch_norm,
-                    dropout=dropout
+                    dropout=dropout,
+                    factorized=pool_factorized,
+                    chunk_size=pool_chunk_size,
+                    memory_budget=pool_memory_budget,
+                    radius=pool_radius
                 )
             elif pooling_type == 'spool':
                 self.pool_net = SocialPooling(
@@ -108,7 +346,8 @@ class Decoder(nn.Module):
                     batch_norm=batch_norm,
                     dropout=dropout,
                     neighborhood_size=neighborhood_size,
-                    grid_size=grid_size
+                    grid_size=grid_size,
+                    neighbor_search=neighbor_search
                 )
 
             mlp_dims = [h_dim + bottleneck_dim, mlp_dim, h_dim]
@@ -162,18 +401,119 @@ class Decoder(nn.Module):
         return pred_traj_fake_rel, state_tuple[0]
 
 
+class ChunkedPairMax(torch.autograd.Function):
+    """
+    Max over j of pair_layers of a PoolHiddenNet, one chunk of pairs at a
+    time: a running max that only keeps, for every output, the pair it comes
+    from. The backward pass recomputes the chunks one at a time, so memory
+    is bounded by the chunk size whatever the number of chunks.
+    """
+    @staticmethod
+    def forward(ctx, net, chunks, num_features, *tensors):
+        """
+        Inputs:
+        - net: PoolHiddenNet
+        - chunks: Output of net.chunks
+        - num_features: Number of tensors of net.ped_features in tensors
+        - tensors: Output of net.ped_features, then the parameters of net to
+        compute gradients for
+        Output:
+        - pool_h: Tensor of shape (batch, bottleneck_dim), in pair order
+        """
+        features = tensors[:num_features]
+        ctx.net, ctx.chunks, ctx.num_features = net, chunks, num_features
+        # The same dropout masks in the backward pass
+        device = features[0].device
+        ctx.rng_state = torch.get_rng_state()
+        if device.type == 'cuda':
+            ctx.cuda_rng_state = torch.cuda.get_rng_state(device)
+        num_rows = max(row + ped_i.size(0) for row, ped_i, _ in chunks)
+        pool_h, best_chunk, best_col = None, None, None
+        for idx, (row, ped_i, ped_j) in enumerate(chunks):
+            value, col = net.pair_chunk(features, ped_i, ped_j).max(1)
+            if pool_h is None:
+                shape = (num_rows, value.size(1))
+                pool_h = value.new_full(shape, float('-inf'))
+                best_chunk = col.new_zeros(shape)
+                best_col = col.new_zeros(shape)
+            rows = slice(row, row + ped_i.size(0))
+            # Strictly greater keeps the first j on ties, as max(1) does
+            better = value > pool_h[rows]
+            pool_h[rows] = torch.where(better, value, pool_h[rows])
+            best_chunk[rows].masked_fill_(better, idx)
+            best_col[rows] = torch.where(better, col, best_col[rows])
+        ctx.save_for_backward(*tensors)
+        ctx.best_chunk, ctx.best_col = best_chunk, best_col
+        return pool_h
+
+    @staticmethod
+    def backward(ctx, grad_pool_h):
+        tensors = ctx.saved_tensors
+        num_features = ctx.num_features
+        needs_grad = ctx.needs_input_grad[3:]
+        features = tuple(
+            t.detach().requires_grad_(needs)
+            for t, needs in zip(tensors[:num_features], needs_grad))
+        params = tensors[num_features:]
+        inputs = [
+            t for t, needs in zip(features + params, needs_grad) if needs]
+        grads = [torch.zeros_like(t) for t in inputs]
+        device = features[0].device
+        devices = [device] if device.type == 'cuda' else []
+        with torch.random.fork_rng(devices=devices), torch.enable_grad():
+            torch.set_rng_state(ctx.rng_state)
+            if devices:
+                torch.cuda.set_rng_state(ctx.cuda_rng_state, device)
+            for idx, (row, ped_i, ped_j) in enumerate(ctx.chunks):
+                rows = slice(row, row + ped_i.size(0))
+                out = ctx.net.pair_chunk(features, ped_i, ped_j)
+                best = ctx.best_chunk[rows] == idx
+                grad_best = grad_pool_h[rows] * best.type_as(grad_pool_h)
+                best_col = ctx.best_col[rows] * best.long()
+                grad_out = torch.zeros_like(out).scatter_(
+                    1, best_col.unsqueeze(1), grad_best.unsqueeze(1))
+                chunk_grads = torch.autograd.grad(
+                    out, inputs, grad_out, allow_unused=True)
+                for grad, chunk_grad in zip(grads, chunk_grads):
+                    if chunk_grad is not None:
+                        grad += chunk_grad
+        grads = iter(grads)
+        return (None, None, None) + tuple(
+            next(grads) if needs else None for needs in needs_grad)
+
+
 class PoolHiddenNet(nn.Module):
     """Pooling module as proposed in our paper"""
     def __init__(
         self, embedding_dim=64, h_dim=64, mlp_dim=1024, bottleneck_dim=1024,
-        activation='relu', batch_norm=True, dropout=0.0
+        activation='relu', batch_norm=True, dropout=0.0, factorized=False,
+        chunk_size=0, memory_budget=0, radius=0
     ):
+        """
+        Args:
+        - factorized: Compute the first layer of mlp_pre_pool per pedestrian
+        rather than per pair (see ped_features). Same parameters and same
+        outputs up to rounding.
+        - chunk_size: Pool at most chunk_size pairs at once (see
+        ChunkedPairMax), 0 for all the pairs of the batch
+        - memory_budget: In MB, picks chunk_size from the estimated memory of
+        a pair (see pair_bytes) when chunk_size is 0
+        Chunking is skipped while batch norm layers are in training mode:
+        their statistics are over all the pairs of a sequence.
+        - radius: Only pool the peds j within radius of ped i (see
+        neighbor_pairs), 0 for all the peds of the sequence. The pairs then
+        scale with the number of neighbors, and are not chunked.
+        """
         super(PoolHiddenNet, self).__init__()
 
         self.mlp_dim = 1024
         self.h_dim = h_dim
         self.bottleneck_dim = bottleneck_dim
         self.embedding_dim = embedding_dim
+        self.factorized = factorized
+        self.chunk_size = chunk_size
+        self.memory_budget = memory_budget
+        self.radius = radius
 
         mlp_pre_dim = embedding_dim + h_dim
         mlp_pre_pool_dims = [mlp_pre_dim, 512, bottleneck_dim]
@@ -198,6 +538,118 @@ class PoolHiddenNet(nn.Module):
         tensor = tensor.view(-1, col_len)
         return tensor
 
+    def ped_features(self, hidden, end_pos):
+        """
+        Per pedestrian tensors the inputs of the pairs are made of (see
+        pair_input): hidden and end_pos, or when factorized the per
+        pedestrian terms of the first linear layer of mlp_pre_pool.
+        spatial_embedding and that layer are both linear, so with
+        W = [W_rel, W_h] its weight
+        W_rel * emb(p_j - p_i) + W_h * h_j + b
+        = A * p_j + W_h * h_j + (W_rel * b_emb + b) - A * p_i
+        with A = W_rel * W_emb, and a pair only costs a subtraction.
+        Inputs:
+        - hidden: Tensor of shape (batch, h_dim)
+        - end_pos: Tensor of shape (batch, 2)
+        Output:
+        - (hidden, end_pos), or when factorized (ped_proj, pos_proj) each of
+        shape (batch, 512)
+        """
+        if not self.factorized:
+            return hidden, end_pos
+        first = self.mlp_pre_pool[0]
+        w_rel = first.weight[:, :self.embedding_dim]
+        w_h = first.weight[:, self.embedding_dim:]
+        pos_weight = torch.matmul(w_rel, self.spatial_embedding.weight)
+        bias = torch.mv(w_rel, self.spatial_embedding.bias) + first.bias
+        pos_proj = torch.matmul(end_pos, pos_weight.t())
+        ped_proj = torch.addmm(bias, hidden, w_h.t()) + pos_proj
+        return ped_proj, pos_proj
+
+    def pair_input(self, features, ped_i, ped_j):
+        """Input of pair_layers for the pairs (ped_i, ped_j), from the
+        output of ped_features"""
+        if self.factorized:
+            ped_proj, pos_proj = features
+            return ped_proj[ped_j] - pos_proj[ped_i]
+        hidden, end_pos = features
+        rel_embedding = self.spatial_embedding(end_pos[ped_j] - end_pos[ped_i])
+        return torch.cat([rel_embedding, hidden[ped_j]], dim=1)
+
+    def pair_layers(self):
+        """Layers of mlp_pre_pool applied to pair_input"""
+        if self.factorized:
+            return list(self.mlp_pre_pool)[1:]
+        return list(self.mlp_pre_pool)
+
+    def pair_bytes(self, element_size=4):
+        """Estimated memory of one pair of a chunk: the activations of
+        pair_layers and their gradients"""
+        first = self.mlp_pre_pool[0]
+        width = first.out_features if self.factorized else first.in_features
+        total = width
+        for layer in self.pair_layers():
+            if isinstance(layer, nn.Linear):
+                width = layer.out_features
+            total += width
+        return 2 * total * element_size
+
+    def get_chunk_size(self, element_size=4):
+        """Number of pairs per chunk, 0 to pool all the pairs at once"""
+        if self.chunk_size:
+            return self.chunk_size
+        if self.memory_budget:
+            budget = int(self.memory_budget * 2 ** 20)
+            return max(1, budget // self.pair_bytes(element_size))
+        return 0
+
+    def pair_chunk(self, features, ped_i, ped_j):
+        """
+        Inputs:
+        - features: Output of ped_features
+        - ped_i, ped_j: LongTensors of shape (num_rows, num_cols)
+        Output:
+        - Tensor of shape (num_rows, num_cols, bottleneck_dim). pair_layers
+        of the pairs
+        """
+        x = self.pair_input(features, ped_i.reshape(-1), ped_j.reshape(-1))
+        for layer in self.pair_layers():
+            x = layer(x)
+        return x.view(ped_i.size(0), ped_i.size(1), -1)
+
+    def chunks(self, pairs, chunk_size):
+        """
+        Splits the pairs into chunks of at most chunk_size pairs (or one
+        column of a sequence, if that is larger): the sequences of each size
+        in blocks of columns j.
+        Inputs:
+        - pairs: Output of scene_pairs
+        - chunk_size: Number of pairs per chunk
+        Output:
+        - List of (row, ped_i, ped_j): the pairs of the peds i of the rows
+        row: row + ped_i.size(0) of the output, in pair order, with the peds
+        j of the columns of ped_i and ped_j
+        """
+        chunks = []
+        row = 0
+        groups = pairs['groups']
+        blocks = pairs['peds'].split(
+            [num_ped * num_seq for num_ped, num_seq in groups])
+        for (num_ped, num_seq), peds in zip(groups, blocks):
+            peds = peds.view(num_seq, num_ped)
+            num_cols = min(num_ped, max(1, chunk_size // peds.numel()))
+            num_rows = max(1, chunk_size // (num_ped * num_cols))
+            for seq_peds in peds.split(num_rows):
+                for col_peds in seq_peds.split(num_cols, dim=1):
+                    num_cols_ = col_peds.size(1)
+                    ped_i = seq_peds.unsqueeze(2).expand(-1, -1, num_cols_)
+                    ped_j = col_peds.unsqueeze(1).expand(-1, num_ped, -1)
+                    chunks.append((
+                        row, ped_i.reshape(-1, num_cols_),
+                        ped_j.reshape(-1, num_cols_)))
+                row += seq_peds.numel()
+        return chunks
+
     def forward(self, h_states, seq_start_end, end_pos):
         """
         Inputs:
@@ -207,27 +659,52 @@ class PoolHiddenNet(nn.Module):
         Output:
         - pool_h: Tensor of shape (batch, bottleneck_dim)
         """
-        pool_h = []
-        for _, (start, end) in enumerate(seq_start_end):
-            start = start.item()
-            end = end.item()
-            num_ped = end - start
-            curr_hidden = h_states.view(-1, self.h_dim)[start:end]
-            curr_end_pos = end_pos[start:end]
-            # Repeat -> H1, H2, H1, H2
-            curr_hidden_1 = curr_hidden.repeat(num_ped, 1)
-            # Repeat position -> P1, P2, P1, P2
-            curr_end_pos_1 = curr_end_pos.repeat(num_ped, 1)
-            # Repeat position -> P1, P1, P2, P2
-            curr_end_pos_2 = self.repeat(curr_end_pos, num_ped)
-            curr_rel_pos = curr_end_pos_1 - curr_end_pos_2
-            curr_rel_embedding = self.spatial_embedding(curr_rel_pos)
-            mlp_h_input = torch.cat([curr_rel_embedding, curr_hidden_1], dim=1)
-            curr_pool_h = self.mlp_pre_pool(mlp_h_input)
-            curr_pool_h = curr_pool_h.view(num_ped, num_ped, -1).max(1)[0]
-            pool_h.append(curr_pool_h)
-        pool_h = torch.cat(pool_h, dim=0)
-        return pool_h
+        if self.radius:
+            return self.neighbor_pool(h_states, seq_start_end, end_pos)
+        # All the scenes of the batch at once: every pair (i, j) of peds of a
+        # scene goes through the mlp in one call, then max over j
+        pairs = scene_pairs(seq_start_end)
+        ped_i, ped_j = pairs['ped_i'], pairs['ped_j']
+        features = self.ped_features(h_states.view(-1, self.h_dim), end_pos)
+        chunk_size = self.get_chunk_size(end_pos.element_size())
+        # Batch norm in training mode needs all the pairs of a sequence
+        batch_stats = any(
+            isinstance(layer, nn.BatchNorm1d) and layer.training
+            for layer in self.mlp_pre_pool)
+        if chunk_size and not batch_stats and ped_i.size(0) > chunk_size:
+            params = [p for p in self.parameters() if p.requires_grad]
+            pool_h = ChunkedPairMax.apply(
+                self, self.chunks(pairs, chunk_size), len(features),
+                *(features + tuple(params)))
+        else:
+            segments = [
+                (num_ped * num_ped, num_seq)
+                for num_ped, num_seq in pairs['groups']
+            ]
+            pool_h = segment_mlp(
+                self.pair_layers(), self.pair_input(features, ped_i, ped_j),
+                segments, pairs['seq_order'])
+            pool_h = group_max(pool_h, pairs['groups'])
+        # Back to the order of the sequences
+        return pool_h.new_empty(pool_h.shape).index_copy_(
+            0, pairs['out_rows'], pool_h)
+
+    def neighbor_pool(self, h_states, seq_start_end, end_pos):
+        """forward over the pairs of neighbor_pairs within radius"""
+        ped_i, ped_j = neighbor_pairs(
+            seq_start_end, end_pos, self.radius, include_self=True)
+        features = self.ped_features(h_states.view(-1, self.h_dim), end_pos)
+        # Batch norm statistics per sequence, over its pairs
+        num_seq = seq_start_end.size(0)
+        seq_idx = torch.repeat_interleave(
+            torch.arange(num_seq, device=ped_i.device),
+            seq_start_end[:, 1] - seq_start_end[:, 0])
+        num_pairs = torch.bincount(seq_idx[ped_i], minlength=num_seq)
+        pool_h = segment_mlp(
+            self.pair_layers(), self.pair_input(features, ped_i, ped_j),
+            [(length, 1) for length in num_pairs.tolist()],
+            torch.arange(num_seq, device=ped_i.device))
+        return pair_max(pool_h, ped_i, end_pos.size(0))
 
 
 class SocialPooling(nn.Module):
@@ -235,12 +712,20 @@ class SocialPooling(nn.Module):
     http://cvgl.stanford.edu/papers/CVPR16_Social_LSTM.pdf"""
     def __init__(
         self, h_dim=64, activation='relu', batch_norm=True, dropout=0.0,
-        neighborhood_size=2.0, grid_size=8, pool_dim=None
+        neighborhood_size=2.0, grid_size=8, pool_dim=None,
+        neighbor_search=False
     ):
+        """
+        Args:
+        - neighbor_search: Only visit the pairs of peds within the
+        neighborhood (see neighbor_pairs) rather than all the pairs of every
+        sequence. Same outputs.
+        """
         super(SocialPooling, self).__init__()
         self.h_dim = h_dim
         self.grid_size = grid_size
         self.neighborhood_size = neighborhood_size
+        self.neighbor_search = neighbor_search
         if pool_dim:
             mlp_pool_dims = [grid_size * grid_size * h_dim, pool_dim]
         else:
@@ -285,6 +770,39 @@ class SocialPooling(nn.Module):
         tensor = tensor.view(-1, col_len)
         return tensor
 
+    def pool_pairs(self, hidden, end_pos, ped_i, ped_j):
+        """
+        Social pooling grids of all the peds of the batch at once, from a
+        list of pairs, with one scatter_add
+        Inputs:
+        - hidden: Tensor of shape (batch, h_dim)
+        - end_pos: Tensor of shape (batch, 2)
+        - ped_i, ped_j: LongTensors of shape (num_pairs, ) of pairs of peds
+        of the same sequence, the pairs of every ped i sorted by j. Pairs
+        (i, i) and peds j outside the neighborhood of i are skipped.
+        Output:
+        - pool_h: Tensor of shape (batch, grid_size * grid_size * h_dim)
+        """
+        batch = hidden.size(0)
+        total_grid_size = self.grid_size * self.grid_size
+        top_left, bottom_right = self.get_bounds(end_pos)
+        top_left, bottom_right = top_left[ped_i], bottom_right[ped_i]
+        other_pos = end_pos[ped_j]
+        grid_pos = self.get_grid_locations(top_left, other_pos).long()
+        # The bounds of the per sequence loop
+        x_bound = ((other_pos[:, 0] >= bottom_right[:, 0]) |
+                   (other_pos[:, 0] <= top_left[:, 0]))
+        y_bound = ((other_pos[:, 1] >= top_left[:, 1]) |
+                   (other_pos[:, 1] <= bottom_right[:, 1]))
+        # Row 0 is the dump of the pairs outside of the neighborhood
+        grid_pos = grid_pos + 1 + ped_i * total_grid_size
+        grid_pos = grid_pos.masked_fill(
+            x_bound | y_bound | (ped_i == ped_j), 0)
+        pool_h = hidden.new_zeros((batch * total_grid_size + 1, self.h_dim))
+        pool_h = pool_h.scatter_add(
+            0, grid_pos.view(-1, 1).expand(-1, self.h_dim), hidden[ped_j])
+        return pool_h[1:].view(batch, -1)
+
     def forward(self, h_states, seq_start_end, end_pos):
         """
         Inputs:
@@ -294,59 +812,17 @@ class SocialPooling(nn.Module):
         Output:
         - pool_h: Tensor of shape (batch, h_dim)
         """
-        pool_h = []
-        for _, (start, end) in enumerate(seq_start_end):
-            start = start.item()
-            end = end.item()
-            num_ped = end - start
-            grid_size = self.grid_size * self.grid_size
-            curr_hidden = h_states.view(-1, self.h_dim)[start:end]
-            curr_hidden_repeat = curr_hidden.repeat(num_ped, 1)
-            curr_end_pos = end_pos[start:end]
-            curr_pool_h_size = (num_ped * grid_size) + 1
-            curr_pool_h = curr_hidden.new_zeros((curr_pool_h_size, self.h_dim))
-            # curr_end_pos = curr_end_pos.data
-            top_left, bottom_right = self.get_bounds(curr_end_pos)
-
-            # Repeat position -> P1, P2, P1, P2
-            curr_end_pos = curr_end_pos.repeat(num_ped, 1)
-            # Repeat bounds -> B1, B1, B2, B2
-            top_left = self.repeat(top_left, num_ped)
-            bottom_right = self.repeat(bottom_right, num_ped)
-
-            grid_pos = self.get_grid_locations(
-                    top_left, curr_end_pos).type_as(seq_start_end)
-            # Make all positions to exclude as non-zero
-            # Find which peds to exclude
-            x_bound = ((curr_end_pos[:, 0] >= bottom_right[:, 0]) +
-                       (curr_end_pos[:, 0] <= top_left[:, 0]))
-            y_bound = ((curr_end_pos[:, 1] >= top_left[:, 1]) +
-                       (curr_end_pos[:, 1] <= bottom_right[:, 1]))
-
-            within_bound = x_bound + y_bound
-            within_bound[0::num_ped + 1] = 1  # Don't include the ped itself
-            within_bound = within_bound.view(-1)
-
-            # This is a tricky way to get scatter add to work. Helps me avoid a
-            # for loop. Offset everything by 1. Use the initial 0 position to
-            # dump all uncessary adds.
-            grid_pos += 1
-            total_grid_size = self.grid_size * self.grid_size
-            offset = torch.arange(
-                0, total_grid_size * num_ped, total_grid_size
-            ).type_as(seq_start_end)
-
-            offset = self.repeat(offset.view(-1, 1), num_ped).view(-1)
-            grid_pos += offset
-            grid_pos[within_bound != 0] = 0
-            grid_pos = grid_pos.view(-1, 1).expand_as(curr_hidden_repeat)
-
-            curr_pool_h = curr_pool_h.scatter_add(0, grid_pos,
-                                                  curr_hidden_repeat)
-            curr_pool_h = curr_pool_h[1:]
-            pool_h.append(curr_pool_h.view(num_ped, -1))
-
-        pool_h = torch.cat(pool_h, dim=0)
+        # All the pairs (i, j) of the batch go into the grids of all the
+        # peds at once, offset by the index of i in the batch
+        if self.neighbor_search:
+            ped_i, ped_j = neighbor_pairs(
+                seq_start_end, end_pos, self.neighborhood_size / 2,
+                norm=float('inf'))
+        else:
+            pairs = scene_pairs(seq_start_end)
+            ped_i, ped_j = pairs['ped_i'], pairs['ped_j']
+        pool_h = self.pool_pairs(
+            h_states.view(-1, self.h_dim), end_pos, ped_i, ped_j)
         pool_h = self.mlp_pool(pool_h)
         return pool_h
 
@@ -357,7 +833,9 @@ class TrajectoryGenerator(nn.Module):
         decoder_h_dim=128, mlp_dim=1024, num_layers=1, noise_dim=(0, ),
         noise_type='gaussian', noise_mix_type='ped', pooling_type=None,
         pool_every_timestep=True, dropout=0.0, bottleneck_dim=1024,
-        activation='relu', batch_norm=True, neighborhood_size=2.0, grid_size=8
+        activation='relu', batch_norm=True, neighborhood_size=2.0, grid_size=8,
+        pool_factorized=False, pool_chunk_size=0, pool_memory_budget=0,
+        pool_radius=0, neighbor_search=False
     ):
         super(TrajectoryGenerator, self).__init__()
 
@@ -400,7 +878,12 @@ class TrajectoryGenerator(nn.Module):
             batch_norm=batch_norm,
             pooling_type=pooling_type,
             grid_size=grid_size,
-            neighborhood_size=neighborhood_size
+            neighborhood_size=neighborhood_size,
+            pool_factorized=pool_factorized,
+            pool_chunk_size=pool_chunk_size,
+            pool_memory_budget=pool_memory_budget,
+            pool_radius=pool_radius,
+            neighbor_search=neighbor_search
         )
 
         if pooling_type == 'pool_net':
@@ -410,7 +893,11 @@ class TrajectoryGenerator(nn.Module):
                 mlp_dim=mlp_dim,
                 bottleneck_dim=bottleneck_dim,
                 activation=activation,
-                batch_norm=batch_norm
+                batch_norm=batch_norm,
+                factorized=pool_factorized,
+                chunk_size=pool_chunk_size,
+                memory_budget=pool_memory_budget,
+                radius=pool_radius
             )
         elif pooling_type == 'spool':
             self.pool_net = SocialPooling(
@@ -419,7 +906,8 @@ class TrajectoryGenerator(nn.Module):
                 batch_norm=batch_norm,
                 dropout=dropout,
                 neighborhood_size=neighborhood_size,
-                grid_size=grid_size
+                grid_size=grid_size,
+                neighbor_search=neighbor_search
             )
 
         if self.noise_dim[0] == 0:
@@ -466,18 +954,12 @@ class TrajectoryGenerator(nn.Module):
         if user_noise is not None:
             z_decoder = user_noise
         else:
-            z_decoder = get_noise(noise_shape, self.noise_type)
+            z_decoder = get_noise(
+                noise_shape, self.noise_type, _input.device, _input.dtype)
 
         if self.noise_mix_type == 'global':
-            _list = []
-            for idx, (start, end) in enumerate(seq_start_end):
-                start = start.item()
-                end = end.item()
-                _vec = z_decoder[idx].view(1, -1)
-                _to_cat = _vec.repeat(end - start, 1)
-                _list.append(torch.cat([_input[start:end], _to_cat], dim=1))
-            decoder_h = torch.cat(_list, dim=0)
-            return decoder_h
+            z_decoder = segment_broadcast(
+                z_decoder.view(seq_start_end.size(0), -1), seq_start_end)
 
         decoder_h = torch.cat([_input, z_decoder], dim=1)
 
@@ -492,7 +974,15 @@ class TrajectoryGenerator(nn.Module):
         else:
             return False
 
-    def forward(self, obs_traj, obs_traj_rel, seq_start_end, user_noise=None):
+    def batch_norm_training(self):
+        return any(
+            isinstance(layer, nn.BatchNorm1d) and layer.training
+            for layer in self.modules())
+
+    def forward(
+        self, obs_traj, obs_traj_rel, seq_start_end, user_noise=None,
+        num_samples=None
+    ):
         """
         Inputs:
         - obs_traj: Tensor of shape (obs_len, batch, 2)
@@ -500,9 +990,26 @@ class TrajectoryGenerator(nn.Module):
         - seq_start_end: A list of tuples which delimit sequences within batch.
         - user_noise: Generally used for inference when you want to see
         relation between different types of noise and outputs.
+        - num_samples: Number of samples to draw at once. The observed part is
+        encoded and pooled once, then the samples are decoded side by side
+        along the batch, each with its own noise. user_noise then holds the
+        noise of the samples one after the other. Batch norm layers in
+        training mode normalize over the batch, so while there are any the
+        samples are drawn by one call each instead, as separate calls would.
         Output:
-        - pred_traj_rel: Tensor of shape (self.pred_len, batch, 2)
+        - pred_traj_rel: Tensor of shape (self.pred_len, batch, 2), or
+        (num_samples, self.pred_len, batch, 2) with num_samples
         """
+        if num_samples is not None and self.batch_norm_training():
+            if user_noise is not None:
+                user_noise = user_noise.view(
+                    (num_samples, -1) + user_noise.shape[1:])
+            return torch.stack([
+                self(obs_traj, obs_traj_rel, seq_start_end,
+                     user_noise=None if user_noise is None else user_noise[k])
+                for k in range(num_samples)
+            ])
+
         batch = obs_traj_rel.size(1)
         # Encode seq
         final_encoder_h = self.encoder(obs_traj_rel)
@@ -522,17 +1029,26 @@ class TrajectoryGenerator(nn.Module):
             noise_input = self.mlp_decoder_context(mlp_decoder_context_input)
         else:
             noise_input = mlp_decoder_context_input
+        last_pos = obs_traj[-1]
+        last_pos_rel = obs_traj_rel[-1]
+        if num_samples is not None:
+            # Sample k is the batch again, its peds offset by k * batch
+            noise_input = noise_input.repeat(num_samples, 1)
+            last_pos = last_pos.repeat(num_samples, 1)
+            last_pos_rel = last_pos_rel.repeat(num_samples, 1)
+            offset = torch.arange(
+                0, num_samples * batch, batch, device=seq_start_end.device)
+            seq_start_end = (
+                seq_start_end.unsqueeze(0) + offset.view(-1, 1, 1)
+            ).view(-1, 2)
         decoder_h = self.add_noise(
             noise_input, seq_start_end, user_noise=user_noise)
         decoder_h = torch.unsqueeze(decoder_h, 0)
 
-        decoder_c = torch.zeros(
-            self.num_layers, batch, self.decoder_h_dim
-        ).cuda()
+        decoder_c = decoder_h.new_zeros(
+            (self.num_layers, decoder_h.size(1), self.decoder_h_dim))
 
         state_tuple = (decoder_h, decoder_c)
-        last_pos = obs_traj[-1]
-        last_pos_rel = obs_traj_rel[-1]
         # Predict Trajectory
 
         decoder_out = self.decoder(
@@ -542,6 +1058,9 @@ class TrajectoryGenerator(nn.Module):
             seq_start_end,
         )
         pred_traj_fake_rel, final_decoder_h = decoder_out
+        if num_samples is not None:
+            pred_traj_fake_rel = pred_traj_fake_rel.view(
+                self.pred_len, num_samples, batch, 2).transpose(0, 1)
 
         return pred_traj_fake_rel
 
@@ -550,7 +1069,8 @@ class TrajectoryDiscriminator(nn.Module):
     def __init__(
         self, obs_len, pred_len, embedding_dim=64, h_dim=64, mlp_dim=1024,
         num_layers=1, activation='relu', batch_norm=True, dropout=0.0,
-        d_type='local'
+        d_type='local', pool_factorized=False, pool_chunk_size=0,
+        pool_memory_budget=0, pool_radius=0
     ):
         super(TrajectoryDiscriminator, self).__init__()
 
@@ -584,7 +1104,11 @@ class TrajectoryDiscriminator(nn.Module):
                 mlp_dim=mlp_pool_dims,
                 bottleneck_dim=h_dim,
                 activation=activation,
-                batch_norm=batch_norm
+                batch_norm=batch_norm,
+                factorized=pool_factorized,
+                chunk_size=pool_chunk_size,
+                memory_budget=pool_memory_budget,
+                radius=pool_radius
             )
 
     def forward(self, traj, traj_rel, seq_start_end=None):
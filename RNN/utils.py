@@ -48,17 +48,25 @@ def get_total_norm(parameters, norm_type=2):
 @contextmanager
 def timeit(msg, should_time=True):
     if should_time:
-        torch.cuda.synchronize()
+        synchronize()
         t0 = time.time()
     yield
     if should_time:
-        torch.cuda.synchronize()
+        synchronize()
         t1 = time.time()
         duration = (t1 - t0) * 1000.0
         print('%s: %.2f ms' % (msg, duration))
 
 
+def synchronize():
+    """Waits for the queued GPU work, if there is a GPU"""
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
 def get_gpu_memory():
+    if not torch.cuda.is_available():
+        return 0
     torch.cuda.synchronize()
     opts = [
         'nvidia-smi', '-q', '--gpu=' + str(1), '|', 'grep', '"Used GPU Memory"'
@@ -72,24 +80,146 @@ def get_gpu_memory():
     return consumed_mem
 
 
-def get_dset_path(dset_name, dset_type):
+@contextmanager
+def inference(model, num_threads=0, eval_mode=True):
+    """
+    Context for predictions of model, for example on CPU-only nodes. Inside
+    - autograd records nothing (torch.inference_mode, or torch.no_grad with
+    versions of torch without it)
+    - num_threads: If > 0, number of threads of the CPU intra-op thread pool
+    - eval_mode: Put model in eval mode: batch norm layers use their running
+    statistics and dropout is off. Otherwise model keeps its mode.
+    The mode of model and the number of threads are restored on exit.
+    """
+    training = model.training
+    threads = torch.get_num_threads()
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if eval_mode:
+        model.eval()
+    no_grad = getattr(torch, 'inference_mode', torch.no_grad)
+    try:
+        with no_grad():
+            yield model
+    finally:
+        model.train(training)
+        torch.set_num_threads(threads)
+
+
+def get_dset_path(dset_name, dset_type, file_store=None, tree='datasets'):
+    """
+    Input:
+    - dset_name, dset_type: Dataset and split, for example zara1 and train
+    - file_store: Store of scripts/build_file_store.py. When given, the
+    manifest of the split is returned instead of its directory.
+    - tree: Directory of the datasets (datasets, datasets2, ...), which is
+    also the name of its manifests in the store
+    """
+    if file_store:
+        path = os.path.join(
+            file_store, 'manifests', tree, dset_name, dset_type + '.manifest')
+        if not os.path.isfile(path):
+            raise ValueError('No manifest for {}/{}/{} in {}'.format(
+                tree, dset_name, dset_type, file_store))
+        return path
     _dir = os.path.dirname(__file__)
     _dir = _dir.split("/")[:-1]
     _dir = "/".join(_dir)
-    return os.path.join(_dir, 'datasets', dset_name, dset_type)
+    return os.path.join(_dir, tree, dset_name, dset_type)
 
 
 def relative_to_abs(rel_traj, start_pos):
     """
     Inputs:
-    - rel_traj: pytorch tensor of shape (seq_len, batch, 2)
+    - rel_traj: pytorch tensor of shape (seq_len, batch, 2), or
+    (num_samples, seq_len, batch, 2)
     - start_pos: pytorch tensor of shape (batch, 2)
     Outputs:
-    - abs_traj: pytorch tensor of shape (seq_len, batch, 2)
+    - abs_traj: pytorch tensor of the shape of rel_traj
     """
-    # batch, seq_len, 2
-    rel_traj = rel_traj.permute(1, 0, 2)
-    displacement = torch.cumsum(rel_traj, dim=1)
-    start_pos = torch.unsqueeze(start_pos, dim=1)
+    displacement = torch.cumsum(rel_traj, dim=-3)
     abs_traj = displacement + start_pos
-    return abs_traj.permute(1, 0, 2)
+    return abs_traj
+
+
+class Segments(object):
+    """Map from the peds of a batch to the sequences of seq_start_end, for
+    the segment reductions below. The sequences are consecutive and cover
+    the batch, as built by seq_collate. Build it once per batch and pass it
+    to all the reductions of the batch."""
+    def __init__(self, seq_start_end):
+        self.num_seq = seq_start_end.size(0)
+        self.lengths = seq_start_end[:, 1] - seq_start_end[:, 0]
+        # Sequence of every ped and its position within the sequence
+        self.ids = torch.repeat_interleave(
+            torch.arange(self.num_seq, device=seq_start_end.device),
+            self.lengths)
+        starts = torch.cumsum(self.lengths, 0) - self.lengths
+        self.rank = torch.arange(
+            self.ids.size(0), device=seq_start_end.device) - starts[self.ids]
+        self.max_len = int(self.lengths.max()) if self.num_seq else 1
+
+
+def get_segments(seq_start_end):
+    """
+    Input:
+    - seq_start_end: LongTensor of shape (num_seq, 2), or Segments
+    Output:
+    - Segments of seq_start_end, built if not given
+    """
+    if isinstance(seq_start_end, Segments):
+        return seq_start_end
+    return Segments(seq_start_end)
+
+
+def segment_sum(x, seq_start_end):
+    """
+    Inputs:
+    - x: Tensor of shape (batch, *)
+    - seq_start_end: LongTensor of shape (num_seq, 2), or Segments
+    Output:
+    - Tensor of shape (num_seq, *). Sum over the peds of every sequence
+    """
+    segments = get_segments(seq_start_end)
+    out = x.new_zeros((segments.num_seq, ) + x.shape[1:])
+    return out.index_add_(0, segments.ids, x)
+
+
+def segment_mean(x, seq_start_end):
+    """Mean over the peds of every sequence, see segment_sum"""
+    segments = get_segments(seq_start_end)
+    lengths = segments.lengths.to(x).view((-1, ) + (1, ) * (x.dim() - 1))
+    return segment_sum(x, segments) / lengths
+
+
+def segment_padded(x, seq_start_end, fill):
+    """
+    Output:
+    - Tensor of shape (num_seq, max_len, *). The peds of every sequence, the
+    sequences shorter than max_len padded with fill
+    """
+    segments = get_segments(seq_start_end)
+    padded = x.new_full(
+        (segments.num_seq, segments.max_len) + x.shape[1:], fill)
+    return padded.index_put((segments.ids, segments.rank), x)
+
+
+def segment_max(x, seq_start_end):
+    """Max over the peds of every sequence, see segment_sum"""
+    return segment_padded(x, seq_start_end, float('-inf')).max(1)[0]
+
+
+def segment_min(x, seq_start_end):
+    """Min over the peds of every sequence, see segment_sum"""
+    return segment_padded(x, seq_start_end, float('inf')).min(1)[0]
+
+
+def segment_broadcast(x, seq_start_end):
+    """
+    Inputs:
+    - x: Tensor of shape (num_seq, *)
+    - seq_start_end: LongTensor of shape (num_seq, 2), or Segments
+    Output:
+    - Tensor of shape (batch, *). Row of its sequence for every ped
+    """
+    return x.index_select(0, get_segments(seq_start_end).ids)
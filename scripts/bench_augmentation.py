@@ -0,0 +1,88 @@
+"""
+Measures the throughput, in pedestrians per second, of BatchAugmentation on
+collated batches against augmenting every sequence on its own with NumPy,
+the way a __getitem__ based augmentation would.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from sgan.data.augmentation import BatchAugmentation
+from sgan.data.trajectories import TrajectoryDataset
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dataset_dir', default='datasets/raw/all_data')
+parser.add_argument('--delim', default='\t')
+parser.add_argument('--batch_size', default=64, type=int)
+parser.add_argument('--num_batches', default=50, type=int)
+parser.add_argument('--num_repeats', default=5, type=int)
+
+
+def augment_sequence(seq, obs_len, rng):
+    """
+    Input:
+    - seq: Numpy array of shape (num_peds, 2, seq_len) of one sequence
+    Output:
+    - Rotated, flipped and jittered seq and its displacements
+    """
+    angle = rng.uniform(-np.pi, np.pi)
+    flip = -1. if rng.rand() < 0.5 else 1.
+    transform = np.array([
+        [np.cos(angle) * flip, -np.sin(angle)],
+        [np.sin(angle) * flip, np.cos(angle)]])
+    center = seq[:, :, obs_len - 1].mean(axis=0)[None, :, None]
+    seq = np.einsum('ij,pjt->pit', transform, seq - center) + center
+    seq[:, :, :obs_len] += rng.normal(
+        scale=0.01, size=seq[:, :, :obs_len].shape)
+    seq_rel = np.zeros(seq.shape)
+    seq_rel[:, :, 1:] = seq[:, :, 1:] - seq[:, :, :-1]
+    return seq, seq_rel
+
+
+def bench(fn, batches, num_repeats):
+    num_peds = sum(batch[0].size(1) for batch in batches)
+    best = float('inf')
+    for _ in range(num_repeats):
+        start = time.time()
+        for batch in batches:
+            fn(batch)
+        best = min(best, time.time() - start)
+    return num_peds / best
+
+
+def main(args):
+    dset = TrajectoryDataset(args.dataset_dir, delim=args.delim)
+    starts = range(0, len(dset) - args.batch_size + 1, args.batch_size)
+    batches = [
+        dset[start:start + args.batch_size]
+        for start in list(starts)[:args.num_batches]
+    ]
+    obs_len = dset.obs_len
+    rng = np.random.RandomState(0)
+
+    def per_sequence(batch):
+        seq = torch.cat(batch[:2], dim=0).permute(1, 2, 0).numpy()
+        for start, end in batch[6].tolist():
+            augment_sequence(seq[start:end], obs_len, rng)
+
+    augment = BatchAugmentation(noise_std=0.01)
+    print('per-sequence numpy: {:.0f} peds/sec'.format(
+        bench(per_sequence, batches, args.num_repeats)))
+    print('batched cpu: {:.0f} peds/sec'.format(
+        bench(augment, batches, args.num_repeats)))
+    if torch.cuda.is_available():
+        cuda_batches = [[tensor.cuda() for tensor in b] for b in batches]
+
+        def batched_cuda(batch):
+            augment(batch)
+            torch.cuda.synchronize()
+        print('batched cuda: {:.0f} peds/sec'.format(
+            bench(batched_cuda, cuda_batches, args.num_repeats)))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,83 @@
+"""
+CPU throughput of TrajectoryGenerator, pooled and unpooled, on batches of
+consecutive scenes of a dataset, for growing numbers of threads: time per
+batch of the model as loaded for training under torch.no_grad against the
+inference context of sgan.utils, and predicted trajectories per second with
+the latter.
+"""
+
+import argparse
+import time
+
+import torch
+
+from sgan.data.trajectories import TrajectoryDataset
+from sgan.models import TrajectoryGenerator
+from sgan.utils import bool_flag, inference
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dataset_dir', default='datasets/raw/all_data')
+parser.add_argument('--delim', default='\t')
+parser.add_argument('--batch_size', default=64, type=int)
+parser.add_argument('--num_batches', default=5, type=int)
+parser.add_argument('--num_samples', default=20, type=int)
+parser.add_argument('--obs_len', default=8, type=int)
+parser.add_argument('--pred_len', default=8, type=int)
+parser.add_argument('--pooling_types', default='pool_net,spool,none')
+parser.add_argument('--batch_norm', default=0, type=bool_flag)
+parser.add_argument('--num_threads', default='1,2,4')
+
+
+def run(generator, batches, num_samples):
+    """Seconds per batch of the predictions of every batch"""
+    start = time.time()
+    for obs_traj, obs_traj_rel, seq_start_end in batches:
+        generator(
+            obs_traj, obs_traj_rel, seq_start_end, num_samples=num_samples)
+    return (time.time() - start) / len(batches)
+
+
+def main(args):
+    dset = TrajectoryDataset(
+        args.dataset_dir, obs_len=args.obs_len, pred_len=args.pred_len,
+        delim=args.delim)
+    batches = []
+    for start in range(
+        0, args.num_batches * args.batch_size, args.batch_size
+    ):
+        batch = dset[start:start + args.batch_size]
+        batches.append((batch[0], batch[2], batch[6]))
+    num_peds = sum(b[0].size(1) for b in batches) / len(batches)
+    torch.manual_seed(0)
+    print('{} scenes, {:.0f} peds per batch, {} samples'.format(
+        args.batch_size, num_peds, args.num_samples))
+    print('{:>9} {:>7} {:>11} {:>12} {:>8} {:>10}'.format(
+        'pooling', 'threads', 'no_grad ms', 'inference ms', 'speedup',
+        'traj/s'))
+    for pooling_type in args.pooling_types.split(','):
+        # Social pooling outputs h_dim features
+        bottleneck_dim = 64 if pooling_type == 'spool' else 1024
+        generator = TrajectoryGenerator(
+            obs_len=args.obs_len, pred_len=args.pred_len, noise_dim=(8, ),
+            pooling_type=pooling_type,
+            pool_every_timestep=pooling_type == 'pool_net',
+            bottleneck_dim=bottleneck_dim, batch_norm=args.batch_norm)
+        for num_threads in [int(n) for n in args.num_threads.split(',')]:
+            threads = torch.get_num_threads()
+            torch.set_num_threads(num_threads)
+            with torch.no_grad():
+                # Warm up the thread pool
+                run(generator, batches[:1], args.num_samples)
+                no_grad_time = run(generator, batches, args.num_samples)
+            torch.set_num_threads(threads)
+            with inference(generator, num_threads):
+                inference_time = run(generator, batches, args.num_samples)
+            print('{:>9} {:>7} {:>11.2f} {:>12.2f} {:>7.2f}x {:>10.0f}'.format(
+                pooling_type, num_threads, 1000 * no_grad_time,
+                1000 * inference_time, no_grad_time / inference_time,
+                num_peds * args.num_samples / inference_time))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,106 @@
+"""
+Compares the per-batch latency and memory of the multi-worker loading paths
+of TrajectoryDataset:
+- collate: workers index the dataset and collate the batch, which is sent
+back through the worker queues (the default DataLoader path)
+- shared: the dataset is in shared memory, workers only batch pedestrian
+ranges and the main process gathers the batch (SeqRangeLoader)
+RSS is the main process only. PSS sums the main process and its workers,
+counting shared pages once.
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+from torch.utils.data import DataLoader
+
+from sgan.data.loader import SeqRangeLoader
+from sgan.data.trajectories import SeqCollate, TrajectoryDataset
+from sgan.utils import bool_flag
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dataset_dir', default='datasets/raw/all_data')
+parser.add_argument('--delim', default='\t')
+parser.add_argument('--obs_len', default=8, type=int)
+parser.add_argument('--pred_len', default=12, type=int)
+parser.add_argument('--skip', default=1, type=int)
+parser.add_argument('--lazy', default=0, type=bool_flag)
+parser.add_argument('--compact', default=0, type=bool_flag)
+parser.add_argument('--batch_size', default=64, type=int)
+parser.add_argument('--num_workers', default='0,2,4,8')
+parser.add_argument('--num_epochs', default=3, type=int)
+
+
+def memory_kb(pid, field):
+    path = '/proc/{}/smaps_rollup'.format(pid)
+    if field == 'VmRSS' or not os.path.exists(path):
+        path = '/proc/{}/status'.format(pid)
+        field = 'VmRSS'
+    with open(path) as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def make_loader(path, dset, num_workers, batch_size):
+    if path == 'shared':
+        return SeqRangeLoader(
+            dset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+    return DataLoader(
+        dset, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+        collate_fn=SeqCollate())
+
+
+def run(path, dset, num_workers, args):
+    loader = make_loader(path, dset, num_workers, args.batch_size)
+    num_batches, elapsed, first = 0, 0.0, []
+    rss, pss = 0, 0
+    for _ in range(args.num_epochs):
+        start = time.time()
+        for batch_idx, batch in enumerate(loader):
+            now = time.time()
+            if batch_idx == 0:
+                # Includes starting the workers
+                first.append(now - start)
+            else:
+                num_batches += 1
+                elapsed += now - start
+            start = now
+            if batch_idx == 1:
+                pids = [os.getpid()] + [
+                    p.pid for p in multiprocessing.active_children()]
+                rss = max(rss, memory_kb(os.getpid(), 'VmRSS'))
+                pss = max(pss, sum(memory_kb(pid, 'Pss') for pid in pids))
+    return {
+        'first_ms': 1000 * sum(first) / len(first),
+        'batch_ms': 1000 * elapsed / max(num_batches, 1),
+        'rss_mb': rss / 1024.,
+        'pss_mb': pss / 1024.,
+    }
+
+
+def main(args):
+    dset = TrajectoryDataset(
+        args.dataset_dir, obs_len=args.obs_len, pred_len=args.pred_len,
+        skip=args.skip, delim=args.delim, lazy=args.lazy,
+        compact=args.compact)
+    print('{} sequences, {} pedestrians'.format(
+        len(dset), dset.seq_start_end[-1][1]))
+    print('{:>8} {:>8} {:>10} {:>10} {:>8} {:>8}'.format(
+        'path', 'workers', 'first ms', 'batch ms', 'RSS MB', 'PSS MB'))
+    # The collate path runs first: the shared path moves the dataset to
+    # shared memory for good
+    for path in ['collate', 'shared']:
+        for num_workers in [int(w) for w in args.num_workers.split(',')]:
+            stats = run(path, dset, num_workers, args)
+            print('{:>8} {:>8} {:>10.1f} {:>10.3f} {:>8.0f} {:>8.0f}'.format(
+                path, num_workers, stats['first_ms'], stats['batch_ms'],
+                stats['rss_mb'], stats['pss_mb']))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
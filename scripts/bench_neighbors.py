@@ -0,0 +1,77 @@
+"""
+Time of the pooling modules on one synthetic crowd of growing size at a fixed
+density, over all the pairs of the scene and over the pairs found by the
+spatial hash of neighbor_pairs: PoolHiddenNet without and with a radius, and
+SocialPooling without and with neighbor_search (same outputs).
+"""
+
+import argparse
+import math
+import time
+
+import torch
+
+from sgan.models import PoolHiddenNet, SocialPooling, neighbor_pairs
+from sgan.utils import bool_flag
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_peds', default='50,100,200,400,800')
+parser.add_argument('--density', default=0.5, type=float)
+parser.add_argument('--radius', default=2.0, type=float)
+parser.add_argument('--neighborhood_size', default=2.0, type=float)
+parser.add_argument('--num_repeats', default=3, type=int)
+parser.add_argument('--use_gpu', default=1, type=bool_flag)
+
+
+def bench(module, inputs, device, num_repeats):
+    """Best time in seconds of module(*inputs) without gradients"""
+    best = float('inf')
+    with torch.no_grad():
+        for _ in range(num_repeats):
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.time()
+            module(*inputs)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            best = min(best, time.time() - start)
+    return best
+
+
+def main(args):
+    use_cuda = args.use_gpu and torch.cuda.is_available()
+    device = torch.device('cuda' if use_cuda else 'cpu')
+    torch.manual_seed(0)
+    pool_net = PoolHiddenNet(batch_norm=False).to(device).eval()
+    social_pool = SocialPooling(
+        h_dim=64, batch_norm=False,
+        neighborhood_size=args.neighborhood_size).to(device).eval()
+    print('device {}, {} peds per m2, radius {}, neighborhood {}'.format(
+        device, args.density, args.radius, args.neighborhood_size))
+    print('{:>6} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+        'peds', 'pairs', 'in range', 'pool all', 'pool hash', 'spool all',
+        'spool hash'))
+    for num_peds in [int(n) for n in args.num_peds.split(',')]:
+        side = math.sqrt(num_peds / args.density)
+        end_pos = torch.rand(num_peds, 2, device=device) * side
+        h_states = torch.randn(1, num_peds, 64, device=device)
+        seq_start_end = torch.tensor([[0, num_peds]], device=device)
+        inputs = (h_states, seq_start_end, end_pos)
+        ped_i, _ = neighbor_pairs(seq_start_end, end_pos, args.radius)
+
+        times = []
+        for radius in [0, args.radius]:
+            pool_net.radius = radius
+            times.append(bench(pool_net, inputs, device, args.num_repeats))
+        for neighbor_search in [False, True]:
+            social_pool.neighbor_search = neighbor_search
+            times.append(
+                bench(social_pool, inputs, device, args.num_repeats))
+        print('{:>6} {:>8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'
+              .format(num_peds, num_peds * num_peds, ped_i.size(0),
+                      *[1000 * t for t in times]))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
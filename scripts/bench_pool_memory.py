@@ -0,0 +1,112 @@
+"""
+Peak memory and time of PoolHiddenNet on one scene of growing size, pooling
+all the pairs at once and in chunks picked from memory budgets. On GPU the
+peak is the one of the caching allocator, on CPU the growth of the peak
+resident memory of a fresh process per run.
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+import torch
+
+from sgan.models import PoolHiddenNet
+from sgan.utils import bool_flag
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_peds', default='50,100,200,400')
+parser.add_argument('--memory_budgets', default='0,256,64')
+parser.add_argument('--backward', default=1, type=bool_flag)
+parser.add_argument('--factorized', default=0, type=bool_flag)
+parser.add_argument('--embedding_dim', default=64, type=int)
+parser.add_argument('--h_dim', default=64, type=int)
+parser.add_argument('--bottleneck_dim', default=1024, type=int)
+parser.add_argument('--use_gpu', default=1, type=bool_flag)
+
+
+def measure(args, num_peds, memory_budget, device):
+    """
+    Output:
+    - (peak memory in MB, seconds of the forward (and backward) pass)
+    """
+    torch.manual_seed(0)
+    net = PoolHiddenNet(
+        embedding_dim=args.embedding_dim, h_dim=args.h_dim,
+        bottleneck_dim=args.bottleneck_dim, batch_norm=False,
+        factorized=args.factorized, memory_budget=memory_budget).to(device)
+
+    def forward_backward(num_peds):
+        h_states = torch.randn(1, num_peds, args.h_dim, device=device)
+        h_states.requires_grad_(bool(args.backward))
+        end_pos = torch.rand(num_peds, 2, device=device) * 20
+        seq_start_end = torch.tensor([[0, num_peds]], device=device)
+        with torch.set_grad_enabled(bool(args.backward)):
+            pool_h = net(h_states, seq_start_end, end_pos)
+            if args.backward:
+                pool_h.sum().backward()
+
+    # Warm up on a small chunked scene: the first run initializes thread
+    # pools, which would count as pooling memory
+    net.chunk_size = 10
+    forward_backward(10)
+    net.chunk_size = 0
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    else:
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    start = time.time()
+    forward_backward(num_peds)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated()
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return (peak - base) / 2 ** 20, time.time() - start
+
+
+def measure_process(queue, *args):
+    queue.put(measure(*args))
+
+
+def main(args):
+    use_cuda = args.use_gpu and torch.cuda.is_available()
+    device = torch.device('cuda' if use_cuda else 'cpu')
+    budgets = [float(b) for b in args.memory_budgets.split(',')]
+    net = PoolHiddenNet(
+        embedding_dim=args.embedding_dim, h_dim=args.h_dim,
+        bottleneck_dim=args.bottleneck_dim, batch_norm=False,
+        factorized=args.factorized)
+    print('device {}, backward {}, {:.1f} KB per pair'.format(
+        device, args.backward, net.pair_bytes() / 1024))
+    print('{:>6} {:>10} {:>10} {:>10} {:>10}'.format(
+        'peds', 'budget MB', 'chunk', 'peak MB', 'ms'))
+    context = multiprocessing.get_context('fork')
+    for num_peds in [int(n) for n in args.num_peds.split(',')]:
+        for budget in budgets:
+            net.memory_budget = budget
+            if use_cuda:
+                peak, elapsed = measure(args, num_peds, budget, device)
+            else:
+                # ru_maxrss never goes down: one process per run
+                queue = context.Queue()
+                process = context.Process(
+                    target=measure_process,
+                    args=(queue, args, num_peds, budget, device))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    raise RuntimeError(
+                        'Run of {} peds failed'.format(num_peds))
+                peak, elapsed = queue.get()
+            print('{:>6} {:>10} {:>10} {:>10.1f} {:>10.1f}'.format(
+                num_peds, budget or 'all', net.get_chunk_size() or 'all',
+                peak, 1000 * elapsed))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,116 @@
+"""
+Compares PoolHiddenNet, batched over the scenes and factorized, against the
+per-scene loop it replaced, on batches of consecutive scenes of a dataset:
+forward + backward time per batch and the largest difference of the outputs
+and of the gradients to the loop.
+"""
+
+import argparse
+import time
+
+import torch
+
+from sgan.data.trajectories import TrajectoryDataset
+from sgan.models import PoolHiddenNet
+from sgan.utils import bool_flag
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dataset_dir', default='datasets/raw/all_data')
+parser.add_argument('--delim', default='\t')
+parser.add_argument('--batch_sizes', default='8,32,64,128')
+parser.add_argument('--num_batches', default=10, type=int)
+parser.add_argument('--embedding_dim', default=64, type=int)
+parser.add_argument('--h_dim', default=64, type=int)
+parser.add_argument('--bottleneck_dim', default=1024, type=int)
+parser.add_argument('--batch_norm', default=0, type=bool_flag)
+parser.add_argument('--use_gpu', default=1, type=bool_flag)
+
+
+def loop_pool(net, h_states, seq_start_end, end_pos):
+    """The per-scene implementation of PoolHiddenNet.forward"""
+    pool_h = []
+    for _, (start, end) in enumerate(seq_start_end):
+        start = start.item()
+        end = end.item()
+        num_ped = end - start
+        curr_hidden = h_states.view(-1, net.h_dim)[start:end]
+        curr_end_pos = end_pos[start:end]
+        curr_hidden_1 = curr_hidden.repeat(num_ped, 1)
+        curr_end_pos_1 = curr_end_pos.repeat(num_ped, 1)
+        curr_end_pos_2 = net.repeat(curr_end_pos, num_ped)
+        curr_rel_pos = curr_end_pos_1 - curr_end_pos_2
+        curr_rel_embedding = net.spatial_embedding(curr_rel_pos)
+        mlp_h_input = torch.cat([curr_rel_embedding, curr_hidden_1], dim=1)
+        curr_pool_h = net.mlp_pre_pool(mlp_h_input)
+        curr_pool_h = curr_pool_h.view(num_ped, num_ped, -1).max(1)[0]
+        pool_h.append(curr_pool_h)
+    return torch.cat(pool_h, dim=0)
+
+
+def run(fn, net, batches, device):
+    """Forward + backward of every batch, returns (seconds per batch,
+    outputs, gradients of the inputs)"""
+    outputs, grads = [], []
+    elapsed = 0.0
+    for h_states, seq_start_end, end_pos in batches:
+        h_states = h_states.clone().requires_grad_()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.time()
+        pool_h = fn(net, h_states, seq_start_end, end_pos)
+        pool_h.sum().backward()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        elapsed += time.time() - start
+        outputs.append(pool_h.detach())
+        grads.append(h_states.grad)
+    return elapsed / len(batches), outputs, grads
+
+
+def max_diff(xs, ys):
+    return max((x - y).abs().max().item() for x, y in zip(xs, ys))
+
+
+def main(args):
+    use_cuda = args.use_gpu and torch.cuda.is_available()
+    device = torch.device('cuda' if use_cuda else 'cpu')
+    dset = TrajectoryDataset(args.dataset_dir, delim=args.delim)
+    net = PoolHiddenNet(
+        embedding_dim=args.embedding_dim, h_dim=args.h_dim,
+        bottleneck_dim=args.bottleneck_dim, batch_norm=args.batch_norm)
+    net.to(device)
+    torch.manual_seed(0)
+    print('device {}, batch_norm {}'.format(device, args.batch_norm))
+    print('{:>6} {:>6} {:>8} {:>20} {:>31}'.format(
+        '', '', 'loop', 'batched', 'factorized'))
+    print('{:>6} {:>6} {:>8} {:>8} {:>11} {:>8} {:>11} {:>11}'.format(
+        'scenes', 'peds', 'ms', 'ms', 'out diff', 'ms', 'out diff',
+        'grad diff'))
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        batches = []
+        for start in range(0, args.num_batches * batch_size, batch_size):
+            batch = dset[start:start + batch_size]
+            end_pos = batch[0][-1].to(device)
+            h_states = torch.randn(1, end_pos.size(0), args.h_dim)
+            batches.append((h_states.to(device), batch[6].to(device), end_pos))
+        num_peds = sum(b[2].size(0) for b in batches) / len(batches)
+        # Same starting running statistics for all
+        state = {k: v.clone() for k, v in net.state_dict().items()}
+        loop_time, loop_out, loop_grad = run(loop_pool, net, batches, device)
+        results = []
+        for factorized in [False, True]:
+            net.load_state_dict(state)
+            net.factorized = factorized
+            results.append(run(PoolHiddenNet.forward, net, batches, device))
+        (batched_time, out, _), (factorized_time, f_out, f_grad) = results
+        print('{:>6} {:>6.0f} {:>8.2f} {:>8.2f} {:>11.2e} {:>8.2f} {:>11.2e} '
+              '{:>11.2e}'.format(
+                  batch_size, num_peds, 1000 * loop_time,
+                  1000 * batched_time, max_diff(out, loop_out),
+                  1000 * factorized_time, max_diff(f_out, loop_out),
+                  max_diff(f_grad, loop_grad)))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,101 @@
+"""
+Time of drawing num_samples predictions of TrajectoryGenerator for batches of
+consecutive scenes of a dataset, one forward pass per sample against one
+forward pass with num_samples, and the largest difference of the predictions
+for the same noise.
+"""
+
+import argparse
+import time
+
+import torch
+
+from sgan.data.trajectories import TrajectoryDataset
+from sgan.models import TrajectoryGenerator
+from sgan.utils import bool_flag
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dataset_dir', default='datasets/raw/all_data')
+parser.add_argument('--delim', default='\t')
+parser.add_argument('--batch_sizes', default='8,32,64')
+parser.add_argument('--num_batches', default=5, type=int)
+parser.add_argument('--num_samples', default=20, type=int)
+parser.add_argument('--obs_len', default=8, type=int)
+parser.add_argument('--pred_len', default=8, type=int)
+parser.add_argument('--pooling_types', default='pool_net,none')
+parser.add_argument('--pool_every_timestep', default=1, type=bool_flag)
+parser.add_argument('--pool_memory_budget', default=0, type=float)
+parser.add_argument('--use_gpu', default=1, type=bool_flag)
+
+
+def run(generator, batches, num_samples, batched, device):
+    """Predictions of every batch without gradients, returns (seconds per
+    batch, predictions)"""
+    outputs = []
+    elapsed = 0.0
+    with torch.no_grad():
+        for obs_traj, obs_traj_rel, seq_start_end, noise in batches:
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.time()
+            if batched:
+                pred = generator(
+                    obs_traj, obs_traj_rel, seq_start_end,
+                    user_noise=noise.view(-1, noise.size(-1)),
+                    num_samples=num_samples)
+            else:
+                pred = torch.stack([
+                    generator(obs_traj, obs_traj_rel, seq_start_end,
+                              user_noise=noise[k])
+                    for k in range(num_samples)])
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            elapsed += time.time() - start
+            outputs.append(pred)
+    return elapsed / len(batches), outputs
+
+
+def main(args):
+    use_cuda = args.use_gpu and torch.cuda.is_available()
+    device = torch.device('cuda' if use_cuda else 'cpu')
+    dset = TrajectoryDataset(
+        args.dataset_dir, obs_len=args.obs_len, pred_len=args.pred_len,
+        delim=args.delim)
+    torch.manual_seed(0)
+    print('device {}, {} samples'.format(device, args.num_samples))
+    print('{:>9} {:>6} {:>6} {:>9} {:>9} {:>8} {:>10}'.format(
+        'pooling', 'scenes', 'peds', 'loop ms', 'batch ms', 'speedup',
+        'diff'))
+    for pooling_type in args.pooling_types.split(','):
+        generator = TrajectoryGenerator(
+            obs_len=args.obs_len, pred_len=args.pred_len, noise_dim=(8, ),
+            noise_mix_type='ped', pooling_type=pooling_type,
+            pool_every_timestep=(
+                args.pool_every_timestep and pooling_type != 'none'),
+            pool_memory_budget=args.pool_memory_budget, batch_norm=False)
+        generator.to(device).eval()
+        for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+            batches = []
+            for start in range(0, args.num_batches * batch_size, batch_size):
+                batch = dset[start:start + batch_size]
+                obs_traj = batch[0].to(device)
+                noise = torch.randn(
+                    args.num_samples, obs_traj.size(1), 8, device=device)
+                batches.append((obs_traj, batch[2].to(device),
+                                batch[6].to(device), noise))
+            num_peds = sum(b[0].size(1) for b in batches) / len(batches)
+            loop_time, loop_out = run(
+                generator, batches, args.num_samples, False, device)
+            batch_time, out = run(
+                generator, batches, args.num_samples, True, device)
+            diff = max((x - y).abs().max().item()
+                       for x, y in zip(out, loop_out))
+            print('{:>9} {:>6} {:>6.0f} {:>9.2f} {:>9.2f} {:>7.1f}x '
+                  '{:>10.2e}'.format(
+                      pooling_type, batch_size, num_peds, 1000 * loop_time,
+                      1000 * batch_time, loop_time / batch_time, diff))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
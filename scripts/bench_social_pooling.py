@@ -0,0 +1,110 @@
+"""
+Compares SocialPooling, one scatter_add over all the scenes of a batch,
+against the per-scene loop it replaced, on batches of consecutive scenes of a
+dataset: forward + backward time per batch and the largest difference of the
+outputs and of the gradients (0 on CPU).
+"""
+
+import argparse
+
+import torch
+
+from bench_pooling import max_diff, run
+from sgan.data.trajectories import TrajectoryDataset
+from sgan.models import SocialPooling
+from sgan.utils import bool_flag
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dataset_dir', default='datasets/raw/all_data')
+parser.add_argument('--delim', default='\t')
+parser.add_argument('--batch_sizes', default='8,32,64,128')
+parser.add_argument('--num_batches', default=10, type=int)
+parser.add_argument('--h_dim', default=64, type=int)
+parser.add_argument('--neighborhood_size', default=2.0, type=float)
+parser.add_argument('--grid_size', default=8, type=int)
+parser.add_argument('--batch_norm', default=0, type=bool_flag)
+parser.add_argument('--use_gpu', default=1, type=bool_flag)
+
+
+def loop_social_pool(net, h_states, seq_start_end, end_pos):
+    """The per-scene implementation of SocialPooling.forward"""
+    pool_h = []
+    for _, (start, end) in enumerate(seq_start_end):
+        start = start.item()
+        end = end.item()
+        num_ped = end - start
+        grid_size = net.grid_size * net.grid_size
+        curr_hidden = h_states.view(-1, net.h_dim)[start:end]
+        curr_hidden_repeat = curr_hidden.repeat(num_ped, 1)
+        curr_end_pos = end_pos[start:end]
+        curr_pool_h_size = (num_ped * grid_size) + 1
+        curr_pool_h = curr_hidden.new_zeros((curr_pool_h_size, net.h_dim))
+        top_left, bottom_right = net.get_bounds(curr_end_pos)
+        curr_end_pos = curr_end_pos.repeat(num_ped, 1)
+        top_left = net.repeat(top_left, num_ped)
+        bottom_right = net.repeat(bottom_right, num_ped)
+        grid_pos = net.get_grid_locations(
+            top_left, curr_end_pos).type_as(seq_start_end)
+        x_bound = ((curr_end_pos[:, 0] >= bottom_right[:, 0]) +
+                   (curr_end_pos[:, 0] <= top_left[:, 0]))
+        y_bound = ((curr_end_pos[:, 1] >= top_left[:, 1]) +
+                   (curr_end_pos[:, 1] <= bottom_right[:, 1]))
+        within_bound = x_bound + y_bound
+        within_bound[0::num_ped + 1] = 1
+        within_bound = within_bound.view(-1)
+        grid_pos += 1
+        offset = torch.arange(
+            0, grid_size * num_ped, grid_size).type_as(seq_start_end)
+        offset = net.repeat(offset.view(-1, 1), num_ped).view(-1)
+        grid_pos += offset
+        grid_pos[within_bound != 0] = 0
+        grid_pos = grid_pos.view(-1, 1).expand_as(curr_hidden_repeat)
+        curr_pool_h = curr_pool_h.scatter_add(
+            0, grid_pos, curr_hidden_repeat)
+        pool_h.append(curr_pool_h[1:].view(num_ped, -1))
+    return net.mlp_pool(torch.cat(pool_h, dim=0))
+
+
+def main(args):
+    use_cuda = args.use_gpu and torch.cuda.is_available()
+    device = torch.device('cuda' if use_cuda else 'cpu')
+    dset = TrajectoryDataset(args.dataset_dir, delim=args.delim)
+    net = SocialPooling(
+        h_dim=args.h_dim, batch_norm=args.batch_norm,
+        neighborhood_size=args.neighborhood_size, grid_size=args.grid_size)
+    net.to(device)
+    torch.manual_seed(0)
+    print('device {}, batch_norm {}'.format(device, args.batch_norm))
+    print('{:>6} {:>6} {:>8} {:>8} {:>10} {:>10} {:>11} {:>11}'.format(
+        'scenes', 'peds', 'loop ms', 'batch ms', 'hash ms', 'speedup',
+        'out diff', 'grad diff'))
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        batches = []
+        for start in range(0, args.num_batches * batch_size, batch_size):
+            batch = dset[start:start + batch_size]
+            end_pos = batch[0][-1].to(device)
+            h_states = torch.randn(1, end_pos.size(0), args.h_dim)
+            batches.append((h_states.to(device), batch[6].to(device), end_pos))
+        num_peds = sum(b[2].size(0) for b in batches) / len(batches)
+        # Same starting running statistics for all
+        state = {k: v.clone() for k, v in net.state_dict().items()}
+        loop_time, loop_out, loop_grad = run(
+            loop_social_pool, net, batches, device)
+        results = []
+        for neighbor_search in [False, True]:
+            net.load_state_dict(state)
+            net.neighbor_search = neighbor_search
+            results.append(run(SocialPooling.forward, net, batches, device))
+        (batch_time, out, grad), (hash_time, hash_out, hash_grad) = results
+        print('{:>6} {:>6.0f} {:>8.2f} {:>8.2f} {:>10.2f} {:>9.1f}x {:>11.2e} '
+              '{:>11.2e}'.format(
+                  batch_size, num_peds, 1000 * loop_time, 1000 * batch_time,
+                  1000 * hash_time, loop_time / batch_time,
+                  max(max_diff(out, loop_out), max_diff(hash_out, loop_out)),
+                  max(max_diff(grad, loop_grad),
+                      max_diff(hash_grad, loop_grad))))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
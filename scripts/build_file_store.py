@@ -0,0 +1,50 @@
+"""
+Moves trees of dataset splits (for example scripts/datasets and
+scripts/datasets2) into a content-addressed file store. Every distinct file
+is stored once under <store_dir>/objects and every split directory becomes
+<store_dir>/manifests/<tree>/<dataset>/<split>.manifest, which
+TrajectoryDataset takes in place of the directory. The leave-one-out splits
+share most of their files, which are then parsed and cached once.
+"""
+
+import argparse
+import os
+
+from sgan.data.trajectories import BINARY_EXT, MANIFEST_EXT
+from sgan.data.trajectories import store_file, write_manifest
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--input_dirs', default='datasets,datasets2')
+parser.add_argument('--store_dir', default='file_store')
+
+
+def main(args):
+    num_files, num_manifests = 0, 0
+    objects = set()
+    for input_dir in args.input_dirs.split(','):
+        tree = os.path.basename(os.path.normpath(input_dir))
+        for root, _, filenames in os.walk(input_dir):
+            filenames = sorted(
+                filename for filename in filenames
+                if filename.endswith(('.txt', BINARY_EXT)))
+            if not filenames:
+                continue
+            object_paths = [
+                store_file(os.path.join(root, filename), args.store_dir)
+                for filename in filenames]
+            manifest_path = os.path.join(
+                args.store_dir, 'manifests', tree,
+                os.path.relpath(root, input_dir) + MANIFEST_EXT)
+            write_manifest(manifest_path, object_paths, filenames)
+            num_files += len(filenames)
+            num_manifests += 1
+            objects.update(object_paths)
+            print('{} -> {} ({} files)'.format(
+                root, manifest_path, len(filenames)))
+    print('Stored {} files of {} splits as {} objects'.format(
+        num_files, num_manifests, len(objects)))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
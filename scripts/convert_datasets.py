@@ -0,0 +1,40 @@
+"""
+Converts a tree of <frame_id> <ped_id> <x> <y> text files (for example
+scripts/datasets) into binary scene files with the same layout, which
+TrajectoryDataset memory-maps instead of parsing.
+"""
+
+import argparse
+import os
+
+from sgan.data.trajectories import BINARY_EXT, read_file, write_binary
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--input_dir', default='datasets')
+parser.add_argument('--output_dir', default='datasets_bin')
+parser.add_argument('--delim', default='tab')
+
+
+def main(args):
+    num_files = 0
+    for root, _, filenames in os.walk(args.input_dir):
+        out_root = os.path.join(
+            args.output_dir, os.path.relpath(root, args.input_dir))
+        for filename in sorted(filenames):
+            if not filename.endswith('.txt'):
+                continue
+            if not os.path.isdir(out_root):
+                os.makedirs(out_root)
+            in_path = os.path.join(root, filename)
+            out_path = os.path.join(
+                out_root, os.path.splitext(filename)[0] + BINARY_EXT)
+            data = read_file(in_path, args.delim)
+            write_binary(out_path, data)
+            num_files += 1
+            print('{} -> {} ({} rows)'.format(in_path, out_path, len(data)))
+    print('Converted {} files'.format(num_files))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -4,18 +4,28 @@ import torch
 
 from attrdict import AttrDict
 
-from sgan.data.loader import data_loader
+from sgan.data.loader import block_loader, data_loader
 from sgan.models import TrajectoryGenerator
 from sgan.losses import displacement_error, final_displacement_error
-from sgan.utils import relative_to_abs, get_dset_path
+from sgan.utils import relative_to_abs, get_dset_path, segment_sum, Segments
+from sgan.utils import bool_flag, inference
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--model_path', type=str)
 parser.add_argument('--num_samples', default=20, type=int)
 parser.add_argument('--dset_type', default='test', type=str)
-
-
-def get_generator(checkpoint):
+parser.add_argument('--file_store', default='')
+parser.add_argument('--use_gpu', default=1, type=bool_flag)
+parser.add_argument('--num_threads', default=0, type=int)
+# The published metrics were computed in train mode, one call per sample,
+# and the default train mode is comparable with them: batch norm still
+# normalizes each sample on its own. With eval mode, models with batch
+# norm or dropout predict as in check_accuracy of train.py, and the
+# metrics are comparable with those logged during training instead.
+parser.add_argument('--eval_mode', default=0, type=bool_flag)
+
+
+def get_generator(checkpoint, device):
     args = AttrDict(checkpoint['args'])
     generator = TrajectoryGenerator(
         obs_len=args.obs_len,
@@ -34,55 +44,55 @@ def get_generator(checkpoint):
         bottleneck_dim=args.bottleneck_dim,
         neighborhood_size=args.neighborhood_size,
         grid_size=args.grid_size,
-        batch_norm=args.batch_norm)
+        batch_norm=args.batch_norm,
+        pool_factorized=args.get('pool_factorized', False),
+        pool_chunk_size=args.get('pool_chunk_size', 0),
+        pool_memory_budget=args.get('pool_memory_budget', 0),
+        pool_radius=args.get('pool_radius', 0),
+        neighbor_search=args.get('neighbor_search', False))
     generator.load_state_dict(checkpoint['g_state'])
-    generator.cuda()
+    generator.to(device)
     generator.train()
     return generator
 
 
-def evaluate_helper(error, seq_start_end):
-    sum_ = 0
+def evaluate_helper(error, segments):
     error = torch.stack(error, dim=1)
-
-    for (start, end) in seq_start_end:
-        start = start.item()
-        end = end.item()
-        _error = error[start:end]
-        _error = torch.sum(_error, dim=0)
-        _error = torch.min(_error)
-        sum_ += _error
-    return sum_
+    # Best sample of every sequence
+    return segment_sum(error, segments).min(1)[0].sum()
 
 
 def evaluate(args, loader, generator, num_samples):
     ade_outer, fde_outer = [], []
     total_traj = 0
+    device = next(generator.parameters()).device
     with torch.no_grad():
         for batch in loader:
-            batch = [tensor.cuda() for tensor in batch]
+            batch = [tensor.to(device) for tensor in batch]
             (obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel,
              non_linear_ped, loss_mask, seq_start_end) = batch
 
             ade, fde = [], []
             total_traj += pred_traj_gt.size(1)
 
-            for _ in range(num_samples):
-                pred_traj_fake_rel = generator(
-                    obs_traj, obs_traj_rel, seq_start_end
-                )
-                pred_traj_fake = relative_to_abs(
-                    pred_traj_fake_rel, obs_traj[-1]
-                )
+            pred_traj_fake_rel = generator(
+                obs_traj, obs_traj_rel, seq_start_end,
+                num_samples=num_samples
+            )
+            pred_traj_fake = relative_to_abs(
+                pred_traj_fake_rel, obs_traj[-1]
+            )
+            for sample in pred_traj_fake:
                 ade.append(displacement_error(
-                    pred_traj_fake, pred_traj_gt, mode='raw'
+                    sample, pred_traj_gt, mode='raw'
                 ))
                 fde.append(final_displacement_error(
-                    pred_traj_fake[-1], pred_traj_gt[-1], mode='raw'
+                    sample[-1], pred_traj_gt[-1], mode='raw'
                 ))
 
-            ade_sum = evaluate_helper(ade, seq_start_end)
-            fde_sum = evaluate_helper(fde, seq_start_end)
+            segments = Segments(seq_start_end)
+            ade_sum = evaluate_helper(ade, segments)
+            fde_sum = evaluate_helper(fde, segments)
 
             ade_outer.append(ade_sum)
             fde_outer.append(fde_sum)
@@ -101,13 +111,19 @@ def main(args):
     else:
         paths = [args.model_path]
 
+    use_cuda = args.use_gpu and torch.cuda.is_available()
+    device = torch.device('cuda' if use_cuda else 'cpu')
     for path in paths:
-        checkpoint = torch.load(path)
-        generator = get_generator(checkpoint)
+        checkpoint = torch.load(path, map_location=device)
+        generator = get_generator(checkpoint, device)
         _args = AttrDict(checkpoint['args'])
-        path = get_dset_path(_args.dataset_name, args.dset_type)
-        _, loader = data_loader(_args, path)
-        ade, fde = evaluate(_args, loader, generator, args.num_samples)
+        path = get_dset_path(
+            _args.dataset_name, args.dset_type, args.file_store,
+            _args.get('dataset_tree', 'datasets'))
+        dset, _ = data_loader(_args, path)
+        loader = block_loader(_args, dset)
+        with inference(generator, args.num_threads, args.eval_mode):
+            ade, fde = evaluate(_args, loader, generator, args.num_samples)
         print('Dataset: {}, Pred Len: {}, ADE: {:.2f}, FDE: {:.2f}'.format(
             _args.dataset_name, _args.pred_len, ade, fde))
 
@@ -11,13 +11,14 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 
-from sgan.data.loader import data_loader
+from sgan.data.augmentation import BatchAugmentation
+from sgan.data.loader import block_loader, data_loader
 from sgan.losses import gan_g_loss, gan_d_loss, l2_loss
-from sgan.losses import displacement_error, final_displacement_error
+from sgan.losses import TRAJECTORY_METRICS, trajectory_metrics
 
 from sgan.models import TrajectoryGenerator, TrajectoryDiscriminator
 from sgan.utils import int_tuple, bool_flag, get_total_norm
-from sgan.utils import relative_to_abs, get_dset_path
+from sgan.utils import relative_to_abs, get_dset_path, segment_sum, Segments
 
 torch.backends.cudnn.benchmark = True
 
@@ -30,12 +31,30 @@ logger = logging.getLogger(__name__)
 parser.add_argument('--dataset_name', default='zara1', type=str)
 parser.add_argument('--delim', default=' ')
 parser.add_argument('--loader_num_workers', default=4, type=int)
+parser.add_argument('--pin_memory', default=0, type=bool_flag)
+# Sets of collate buffers reused round robin with --loader_num_workers 0.
+# A batch is overwritten that many batches later; 0 allocates every batch.
+parser.add_argument('--collate_buffers', default=0, type=int)
 parser.add_argument('--obs_len', default=8, type=int)
 parser.add_argument('--pred_len', default=8, type=int)
 parser.add_argument('--skip', default=1, type=int)
+parser.add_argument('--compact', default=0, type=bool_flag)
+
+# Augmentation options
+parser.add_argument('--augment', default=0, type=bool_flag)
+parser.add_argument('--augment_scale', default=0.0, type=float)
+parser.add_argument('--augment_reverse_prob', default=0.0, type=float)
+parser.add_argument('--augment_noise_std', default=0.0, type=float)
+parser.add_argument('--cache_dir', default=os.path.join(
+    os.path.expanduser('~'), '.cache', 'trajectories'))
+parser.add_argument('--file_store', default='')
+parser.add_argument('--dataset_tree', default='datasets')
 
 # Optimization
 parser.add_argument('--batch_size', default=64, type=int)
+parser.add_argument('--max_peds_per_batch', default=0, type=int)
+parser.add_argument('--max_pairs_per_batch', default=0, type=int)
+parser.add_argument('--contiguous_batches', default=0, type=bool_flag)
 parser.add_argument('--num_iterations', default=10000, type=int)
 parser.add_argument('--num_epochs', default=200, type=int)
 
@@ -62,10 +81,15 @@ parser.add_argument('--pool_every_timestep', default=1, type=bool_flag)
 
 # Pool Net Option
 parser.add_argument('--bottleneck_dim', default=1024, type=int)
+parser.add_argument('--pool_factorized', default=0, type=bool_flag)
+parser.add_argument('--pool_chunk_size', default=0, type=int)
+parser.add_argument('--pool_memory_budget', default=0, type=float)
+parser.add_argument('--pool_radius', default=0, type=float)
 
 # Social Pooling Options
 parser.add_argument('--neighborhood_size', default=2.0, type=float)
 parser.add_argument('--grid_size', default=8, type=int)
+parser.add_argument('--neighbor_search', default=0, type=bool_flag)
 
 # Discriminator Options
 parser.add_argument('--d_type', default='local', type=str)
@@ -110,17 +134,26 @@ def get_dtypes(args):
 
 def main(args):
     os.environ["CUDA_VISIBLE_DEVICES"] = args.gpu_num
-    train_path = get_dset_path(args.dataset_name, 'train')
-    val_path = get_dset_path(args.dataset_name, 'val')
+    train_path = get_dset_path(
+        args.dataset_name, 'train', args.file_store, args.dataset_tree)
+    val_path = get_dset_path(
+        args.dataset_name, 'val', args.file_store, args.dataset_tree)
 
     long_dtype, float_dtype = get_dtypes(args)
 
     logger.info("Initializing train dataset")
     train_dset, train_loader = data_loader(args, train_path)
     logger.info("Initializing val dataset")
-    _, val_loader = data_loader(args, val_path)
+    val_dset, _ = data_loader(args, val_path)
+    # Stats are checked on views of consecutive sequences: the val set in
+    # one pass, the train set in shuffled blocks since it is cut short
+    val_check_loader = block_loader(args, val_dset)
+    train_check_loader = block_loader(args, train_dset, shuffle=True)
 
     iterations_per_epoch = len(train_dset) / args.batch_size / args.d_steps
+    if (args.max_peds_per_batch or args.max_pairs_per_batch or
+            args.contiguous_batches):
+        iterations_per_epoch = len(train_loader) / args.d_steps
     if args.num_epochs:
         args.num_iterations = int(iterations_per_epoch * args.num_epochs)
 
@@ -145,6 +178,11 @@ def main(args):
         bottleneck_dim=args.bottleneck_dim,
         neighborhood_size=args.neighborhood_size,
         grid_size=args.grid_size,
+        pool_factorized=args.pool_factorized,
+        pool_chunk_size=args.pool_chunk_size,
+        pool_memory_budget=args.pool_memory_budget,
+        pool_radius=args.pool_radius,
+        neighbor_search=args.neighbor_search,
         batch_norm=args.batch_norm)
 
     generator.apply(init_weights)
@@ -161,7 +199,11 @@ def main(args):
         num_layers=args.num_layers,
         dropout=args.dropout,
         batch_norm=args.batch_norm,
-        d_type=args.d_type)
+        d_type=args.d_type,
+        pool_factorized=args.pool_factorized,
+        pool_chunk_size=args.pool_chunk_size,
+        pool_memory_budget=args.pool_memory_budget,
+        pool_radius=args.pool_radius)
 
     discriminator.apply(init_weights)
     discriminator.type(float_dtype).train()
@@ -223,6 +265,12 @@ def main(args):
             'd_best_state_nl': None,
             'best_t_nl': None,
         }
+    augment = None
+    if args.augment:
+        augment = BatchAugmentation(
+            scale_range=(1 - args.augment_scale, 1 + args.augment_scale),
+            reverse_prob=args.augment_reverse_prob,
+            noise_std=args.augment_noise_std)
     t0 = None
     while t < args.num_iterations:
         gc.collect()
@@ -231,6 +279,9 @@ def main(args):
         epoch += 1
         logger.info('Starting epoch {}'.format(epoch))
         for batch in train_loader:
+            if augment is not None:
+                # Applied on the GPU to the whole batch
+                batch = augment([tensor.cuda() for tensor in batch])
             if args.timing == 1:
                 torch.cuda.synchronize()
                 t1 = time.time()
@@ -292,11 +343,12 @@ def main(args):
                 # Check stats on the validation set
                 logger.info('Checking stats on val ...')
                 metrics_val = check_accuracy(
-                    args, val_loader, generator, discriminator, d_loss_fn
+                    args, val_check_loader, generator, discriminator,
+                    d_loss_fn
                 )
                 logger.info('Checking stats on train ...')
                 metrics_train = check_accuracy(
-                    args, train_loader, generator, discriminator,
+                    args, train_check_loader, generator, discriminator,
                     d_loss_fn, limit=True
                 )
 
@@ -409,28 +461,30 @@ def generator_step(
 
     loss_mask = loss_mask[:, args.obs_len:]
 
-    for _ in range(args.best_k):
-        generator_out = generator(obs_traj, obs_traj_rel, seq_start_end)
+    # The best_k samples in one rollout of the generator
+    generator_out = generator(
+        obs_traj, obs_traj_rel, seq_start_end, num_samples=args.best_k)
 
-        pred_traj_fake_rel = generator_out
-        pred_traj_fake = relative_to_abs(pred_traj_fake_rel, obs_traj[-1])
-
-        if args.l2_loss_weight > 0:
+    if args.l2_loss_weight > 0:
+        for pred_traj_fake_rel in generator_out:
             g_l2_loss_rel.append(args.l2_loss_weight * l2_loss(
                 pred_traj_fake_rel,
                 pred_traj_gt_rel,
                 loss_mask,
                 mode='raw'))
 
+    # The discriminator scores the last sample
+    pred_traj_fake_rel = generator_out[-1]
+    pred_traj_fake = relative_to_abs(pred_traj_fake_rel, obs_traj[-1])
+
     g_l2_loss_sum_rel = torch.zeros(1).to(pred_traj_gt)
     if args.l2_loss_weight > 0:
         g_l2_loss_rel = torch.stack(g_l2_loss_rel, dim=1)
-        for start, end in seq_start_end.data:
-            _g_l2_loss_rel = g_l2_loss_rel[start:end]
-            _g_l2_loss_rel = torch.sum(_g_l2_loss_rel, dim=0)
-            _g_l2_loss_rel = torch.min(_g_l2_loss_rel) / torch.sum(
-                loss_mask[start:end])
-            g_l2_loss_sum_rel += _g_l2_loss_rel
+        # Best sample of every sequence, over its number of predicted steps
+        segments = Segments(seq_start_end)
+        g_l2_loss_rel = segment_sum(g_l2_loss_rel, segments).min(1)[0]
+        g_l2_loss_sum_rel += torch.sum(
+            g_l2_loss_rel / segment_sum(loss_mask, segments).sum(1))
         losses['G_l2_loss_rel'] = g_l2_loss_sum_rel.item()
         loss += g_l2_loss_sum_rel
 
@@ -458,12 +512,9 @@ def generator_step(
 def check_accuracy(
     args, loader, generator, discriminator, d_loss_fn, limit=False
 ):
-    d_losses = []
+    batch_sums = []
     metrics = {}
-    g_l2_losses_abs, g_l2_losses_rel = ([],) * 2
-    disp_error, disp_error_l, disp_error_nl = ([],) * 3
-    f_disp_error, f_disp_error_l, f_disp_error_nl = ([],) * 3
-    total_traj, total_traj_l, total_traj_nl = 0, 0, 0
+    total_traj = 0
     loss_mask_sum = 0
     generator.eval()
     with torch.no_grad():
@@ -471,7 +522,6 @@ def check_accuracy(
             batch = [tensor.cuda() for tensor in batch]
             (obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel,
              non_linear_ped, loss_mask, seq_start_end) = batch
-            linear_ped = 1 - non_linear_ped
             loss_mask = loss_mask[:, args.obs_len:]
 
             pred_traj_fake_rel = generator(
@@ -479,18 +529,6 @@ def check_accuracy(
             )
             pred_traj_fake = relative_to_abs(pred_traj_fake_rel, obs_traj[-1])
 
-            g_l2_loss_abs, g_l2_loss_rel = cal_l2_losses(
-                pred_traj_gt, pred_traj_gt_rel, pred_traj_fake,
-                pred_traj_fake_rel, loss_mask
-            )
-            ade, ade_l, ade_nl = cal_ade(
-                pred_traj_gt, pred_traj_fake, linear_ped, non_linear_ped
-            )
-
-            fde, fde_l, fde_nl = cal_fde(
-                pred_traj_gt, pred_traj_fake, linear_ped, non_linear_ped
-            )
-
             traj_real = torch.cat([obs_traj, pred_traj_gt], dim=0)
             traj_real_rel = torch.cat([obs_traj_rel, pred_traj_gt_rel], dim=0)
             traj_fake = torch.cat([obs_traj, pred_traj_fake], dim=0)
@@ -500,40 +538,43 @@ def check_accuracy(
             scores_real = discriminator(traj_real, traj_real_rel, seq_start_end)
 
             d_loss = d_loss_fn(scores_real, scores_fake)
-            d_losses.append(d_loss.item())
 
-            g_l2_losses_abs.append(g_l2_loss_abs.item())
-            g_l2_losses_rel.append(g_l2_loss_rel.item())
-            disp_error.append(ade.item())
-            disp_error_l.append(ade_l.item())
-            disp_error_nl.append(ade_nl.item())
-            f_disp_error.append(fde.item())
-            f_disp_error_l.append(fde_l.item())
-            f_disp_error_nl.append(fde_nl.item())
+            # Stays on the device until the end of the loop
+            metric_sums = trajectory_metrics(
+                pred_traj_fake, pred_traj_gt, pred_traj_fake_rel,
+                pred_traj_gt_rel, loss_mask, non_linear_ped
+            )
+            batch_sums.append(torch.cat([
+                metric_sums,
+                torch.stack([d_loss, torch.sum(non_linear_ped)]).to(
+                    metric_sums)
+            ]))
 
             loss_mask_sum += torch.numel(loss_mask.data)
             total_traj += pred_traj_gt.size(1)
-            total_traj_l += torch.sum(linear_ped).item()
-            total_traj_nl += torch.sum(non_linear_ped).item()
             if limit and total_traj >= args.num_samples_check:
                 break
 
-    metrics['d_loss'] = sum(d_losses) / len(d_losses)
-    metrics['g_l2_loss_abs'] = sum(g_l2_losses_abs) / loss_mask_sum
-    metrics['g_l2_loss_rel'] = sum(g_l2_losses_rel) / loss_mask_sum
+    sums = torch.stack(batch_sums).double().sum(dim=0).tolist()
+    sums = dict(zip(TRAJECTORY_METRICS + ('d_loss', 'total_traj_nl'), sums))
+    total_traj_nl = sums['total_traj_nl']
+    total_traj_l = total_traj - total_traj_nl
+
+    metrics['d_loss'] = sums['d_loss'] / len(batch_sums)
+    metrics['g_l2_loss_abs'] = sums['g_l2_loss_abs'] / loss_mask_sum
+    metrics['g_l2_loss_rel'] = sums['g_l2_loss_rel'] / loss_mask_sum
 
-    metrics['ade'] = sum(disp_error) / (total_traj * args.pred_len)
-    metrics['fde'] = sum(f_disp_error) / total_traj
+    metrics['ade'] = sums['ade'] / (total_traj * args.pred_len)
+    metrics['fde'] = sums['fde'] / total_traj
     if total_traj_l != 0:
-        metrics['ade_l'] = sum(disp_error_l) / (total_traj_l * args.pred_len)
-        metrics['fde_l'] = sum(f_disp_error_l) / total_traj_l
+        metrics['ade_l'] = sums['ade_l'] / (total_traj_l * args.pred_len)
+        metrics['fde_l'] = sums['fde_l'] / total_traj_l
     else:
         metrics['ade_l'] = 0
         metrics['fde_l'] = 0
     if total_traj_nl != 0:
-        metrics['ade_nl'] = sum(disp_error_nl) / (
-            total_traj_nl * args.pred_len)
-        metrics['fde_nl'] = sum(f_disp_error_nl) / total_traj_nl
+        metrics['ade_nl'] = sums['ade_nl'] / (total_traj_nl * args.pred_len)
+        metrics['fde_nl'] = sums['fde_nl'] / total_traj_nl
     else:
         metrics['ade_nl'] = 0
         metrics['fde_nl'] = 0
@@ -542,39 +583,6 @@ def check_accuracy(
     return metrics
 
 
-def cal_l2_losses(
-    pred_traj_gt, pred_traj_gt_rel, pred_traj_fake, pred_traj_fake_rel,
-    loss_mask
-):
-    g_l2_loss_abs = l2_loss(
-        pred_traj_fake, pred_traj_gt, loss_mask, mode='sum'
-    )
-    g_l2_loss_rel = l2_loss(
-        pred_traj_fake_rel, pred_traj_gt_rel, loss_mask, mode='sum'
-    )
-    return g_l2_loss_abs, g_l2_loss_rel
-
-
-def cal_ade(pred_traj_gt, pred_traj_fake, linear_ped, non_linear_ped):
-    ade = displacement_error(pred_traj_fake, pred_traj_gt)
-    ade_l = displacement_error(pred_traj_fake, pred_traj_gt, linear_ped)
-    ade_nl = displacement_error(pred_traj_fake, pred_traj_gt, non_linear_ped)
-    return ade, ade_l, ade_nl
-
-
-def cal_fde(
-    pred_traj_gt, pred_traj_fake, linear_ped, non_linear_ped
-):
-    fde = final_displacement_error(pred_traj_fake[-1], pred_traj_gt[-1])
-    fde_l = final_displacement_error(
-        pred_traj_fake[-1], pred_traj_gt[-1], linear_ped
-    )
-    fde_nl = final_displacement_error(
-        pred_traj_fake[-1], pred_traj_gt[-1], non_linear_ped
-    )
-    return fde, fde_l, fde_nl
-
-
 if __name__ == '__main__':
     args = parser.parse_args()
     main(args)
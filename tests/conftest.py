@@ -0,0 +1,37 @@
+import importlib.util
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The package lives in RNN/ but is imported as sgan, as by the scripts
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if 'sgan' not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        'sgan', os.path.join(ROOT, 'RNN', '__init__.py'),
+        submodule_search_locations=[os.path.join(ROOT, 'RNN')])
+    sys.modules['sgan'] = importlib.util.module_from_spec(spec)
+# Scripts, and RNN/data whose loader imports its siblings as top-level
+# modules
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+sys.path.insert(0, os.path.join(ROOT, 'RNN', 'data'))
+
+
+def write_scene(_path, seed, num_frames=30, num_peds=3):
+    rng = np.random.RandomState(seed)
+    with open(_path, 'w') as f:
+        for frame in range(num_frames):
+            for ped in range(num_peds):
+                x, y = rng.rand(2) * 10
+                f.write('{}\t{}\t{:.4f}\t{:.4f}\n'.format(
+                    frame * 10, seed * 10 + ped, x, y))
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = tmp_path / 'train'
+    data_dir.mkdir()
+    for seed, name in enumerate(['c.txt', 'a.txt', 'b.txt']):
+        write_scene(str(data_dir / name), seed)
+    return str(data_dir)
@@ -0,0 +1,28 @@
+import types
+
+import pytest
+import torch
+
+from sgan.data.trajectories import TrajectoryDataset
+from sgan.models import TrajectoryGenerator
+from sgan.utils import inference
+
+pytest.importorskip('attrdict')
+from evaluate_model import evaluate  # noqa: E402
+
+
+@pytest.mark.parametrize('noise_mix_type', ['ped', 'global'])
+@pytest.mark.parametrize('eval_mode', [True, False])
+def test_evaluate_cpu_inference(data_dir, noise_mix_type, eval_mode):
+    dset = TrajectoryDataset(data_dir)
+    loader = [dset[start:start + 4] for start in range(0, len(dset), 4)]
+    generator = TrajectoryGenerator(
+        obs_len=8, pred_len=12, mlp_dim=64, noise_dim=(8, ),
+        noise_mix_type=noise_mix_type, pooling_type='pool_net',
+        bottleneck_dim=32, batch_norm=True)
+    args = types.SimpleNamespace(pred_len=12)
+    with inference(generator, num_threads=1, eval_mode=eval_mode):
+        assert generator.training != eval_mode
+        ade, fde = evaluate(args, loader, generator, num_samples=3)
+    assert generator.training
+    assert torch.isfinite(ade) and torch.isfinite(fde)
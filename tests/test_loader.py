@@ -0,0 +1,44 @@
+import torch
+
+from sgan.data.loader import data_loader
+from train import parser
+
+
+def loader_args(tmp_path, *argv):
+    return parser.parse_args([
+        '--loader_num_workers', '0', '--use_gpu', '0',
+        '--cache_dir', str(tmp_path / 'cache')] + list(argv))
+
+
+def test_data_loader_main_process(data_dir, tmp_path):
+    args = loader_args(tmp_path)
+    dset, loader = data_loader(args, data_dir)
+    num_peds = 0
+    for batch in loader:
+        obs_traj, seq_start_end = batch[0], batch[-1]
+        assert obs_traj.shape[0] == args.obs_len
+        assert seq_start_end[-1, 1] == obs_traj.size(1)
+        num_peds += obs_traj.size(1)
+    assert num_peds == dset.obs_traj.size(0)
+
+
+def test_data_loader_keeps_batches(data_dir, tmp_path):
+    args = loader_args(tmp_path, '--batch_size', '2')
+    _, loader = data_loader(args, data_dir)
+    batches, copies = [], []
+    for batch in loader:
+        batches.append(batch)
+        copies.append([tensor.clone() for tensor in batch])
+    assert len(batches) > 2
+    # Later batches did not overwrite the kept ones
+    for batch, copy in zip(batches, copies):
+        for tensor, tensor_copy in zip(batch, copy):
+            assert torch.equal(tensor, tensor_copy)
+
+
+def test_data_loader_collate_buffers(data_dir, tmp_path):
+    args = loader_args(
+        tmp_path, '--batch_size', '2', '--collate_buffers', '2')
+    _, loader = data_loader(args, data_dir)
+    batches = [batch[0].data_ptr() for batch in loader]
+    assert len(set(batches)) == 2
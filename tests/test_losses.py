@@ -0,0 +1,27 @@
+import torch
+
+from sgan.losses import TRAJECTORY_METRICS, displacement_error
+from sgan.losses import final_displacement_error, l2_loss, trajectory_metrics
+
+
+def test_trajectory_metrics():
+    torch.manual_seed(0)
+    pred_traj, pred_traj_gt = torch.randn(2, 12, 7, 2)
+    pred_traj_rel, pred_traj_gt_rel = torch.randn(2, 12, 7, 2)
+    loss_mask = (torch.rand(7, 12) > 0.2).float()
+    non_linear_ped = torch.tensor([0., 1., 1., 0., 1., 0., 0.])
+    linear_ped = 1 - non_linear_ped
+    expected = []
+    for peds in [None, linear_ped, non_linear_ped]:
+        expected.append(displacement_error(pred_traj, pred_traj_gt, peds))
+    for peds in [None, linear_ped, non_linear_ped]:
+        expected.append(final_displacement_error(
+            pred_traj[-1], pred_traj_gt[-1], peds))
+    expected.append(l2_loss(pred_traj, pred_traj_gt, loss_mask, mode='sum'))
+    expected.append(
+        l2_loss(pred_traj_rel, pred_traj_gt_rel, loss_mask, mode='sum'))
+    metrics = trajectory_metrics(
+        pred_traj, pred_traj_gt, pred_traj_rel, pred_traj_gt_rel, loss_mask,
+        non_linear_ped)
+    assert metrics.shape == (len(TRAJECTORY_METRICS), )
+    assert torch.allclose(metrics, torch.stack(expected))
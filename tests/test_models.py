@@ -0,0 +1,62 @@
+import pytest
+import torch
+
+from sgan.models import PoolHiddenNet, TrajectoryGenerator
+
+
+def test_pool_net_batch_norm_one_ped_scene():
+    torch.manual_seed(0)
+    net = PoolHiddenNet(
+        embedding_dim=16, h_dim=16, mlp_dim=32, bottleneck_dim=8,
+        batch_norm=True)
+    # The second scene has a single pedestrian
+    seq_start_end = torch.tensor([[0, 3], [3, 4], [4, 6]])
+    h_states = torch.randn(1, 6, 16)
+    end_pos = torch.randn(6, 2)
+    pool_h = net(h_states, seq_start_end, end_pos)
+    assert torch.isfinite(pool_h).all()
+    for layer in net.modules():
+        if isinstance(layer, torch.nn.BatchNorm1d):
+            assert torch.isfinite(layer.running_var).all()
+    net.eval()
+    assert torch.isfinite(net(h_states, seq_start_end, end_pos)).all()
+
+
+def batch_norm_state(module):
+    return [
+        tensor.clone() for layer in module.modules()
+        if isinstance(layer, torch.nn.BatchNorm1d)
+        for tensor in (layer.running_mean, layer.running_var)]
+
+
+@pytest.mark.parametrize('noise_mix_type', ['ped', 'global'])
+@pytest.mark.parametrize('training', [True, False])
+def test_generator_num_samples_batch_norm(noise_mix_type, training):
+    torch.manual_seed(0)
+    generator = TrajectoryGenerator(
+        obs_len=8, pred_len=4, embedding_dim=16, encoder_h_dim=16,
+        decoder_h_dim=32, mlp_dim=32, noise_dim=(8, ),
+        noise_mix_type=noise_mix_type, pooling_type='pool_net',
+        bottleneck_dim=16, batch_norm=True)
+    generator.train(training)
+    seq_start_end = torch.tensor([[0, 3], [3, 5]])
+    obs_traj_rel = torch.randn(8, 5, 2)
+    obs_traj = torch.cumsum(obs_traj_rel, dim=0)
+    num_samples = 3
+    noise_rows = 5 if noise_mix_type == 'ped' else 2
+    noise = torch.randn(num_samples, noise_rows, 8)
+    state = {k: v.clone() for k, v in generator.state_dict().items()}
+
+    loop = torch.stack([
+        generator(obs_traj, obs_traj_rel, seq_start_end, user_noise=noise[k])
+        for k in range(num_samples)])
+    loop_stats = batch_norm_state(generator)
+
+    generator.load_state_dict(state)
+    batched = generator(
+        obs_traj, obs_traj_rel, seq_start_end,
+        user_noise=noise.view(-1, 8), num_samples=num_samples)
+    assert batched.shape == loop.shape
+    assert torch.allclose(batched, loop, atol=1e-6)
+    for tensor, loop_tensor in zip(batch_norm_state(generator), loop_stats):
+        assert torch.allclose(tensor, loop_tensor)
@@ -0,0 +1,55 @@
+import logging
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from sgan.data.trajectories import MANIFEST_EXT, TrajectoryDataset
+from sgan.data.trajectories import parse_rows, store_file, write_manifest
+
+
+def test_parse_rows():
+    data = parse_rows('1\t2\t3.5\t4\n5\t6\t7\t-8\n')
+    np.testing.assert_array_equal(
+        data, [[1, 2, 3.5, 4], [5, 6, 7, -8]])
+
+
+def test_parse_rows_malformed_row():
+    # The rows read before the bad token still make whole rows
+    text = '1\t2\t3\t4\n5\t6\t7\t8\n9\tx\t1\t2\n3\t4\t5\t6\t7\t8\t9\t0\n'
+    with pytest.raises(ValueError, match='bad.txt'):
+        parse_rows(text, _path='bad.txt')
+
+
+def test_parse_rows_missing_column():
+    with pytest.raises(ValueError):
+        parse_rows('1 2 3 4\n5 6 7\n', delim='space')
+
+
+def assert_same_dataset(dset, other):
+    assert dset.file_names == other.file_names
+    for name in ['obs_traj', 'pred_traj', 'obs_traj_rel', 'non_linear_ped']:
+        assert torch.equal(getattr(dset, name), getattr(other, name))
+
+
+def test_combined_cache(data_dir, tmp_path, caplog):
+    cache_dir = str(tmp_path / 'cache')
+    dset = TrajectoryDataset(data_dir, cache_dir=cache_dir)
+    with caplog.at_level(logging.INFO):
+        cached = TrajectoryDataset(data_dir, cache_dir=cache_dir)
+    assert 'Loading cached dataset' in caplog.text
+    assert_same_dataset(dset, cached)
+
+
+def test_manifest_order(data_dir, tmp_path):
+    store_dir = str(tmp_path / 'store')
+    names = ['b.txt', 'c.txt', 'a.txt']
+    object_paths = [
+        store_file(os.path.join(data_dir, name), store_dir)
+        for name in names]
+    manifest_path = os.path.join(store_dir, 'train' + MANIFEST_EXT)
+    write_manifest(manifest_path, object_paths, names)
+    dset = TrajectoryDataset(data_dir)
+    assert dset.file_names == ['a.txt', 'b.txt', 'c.txt']
+    assert_same_dataset(dset, TrajectoryDataset(manifest_path))
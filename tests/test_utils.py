@@ -0,0 +1,64 @@
+import os
+
+import pytest
+import torch
+
+from sgan.utils import Segments, get_dset_path, segment_broadcast
+from sgan.utils import segment_max, segment_mean, segment_min, segment_sum
+
+
+def test_get_dset_path_file_store(tmp_path):
+    for tree in ['datasets', 'datasets2']:
+        split = tmp_path / 'manifests' / tree / 'zara1'
+        split.mkdir(parents=True)
+        (split / 'train.manifest').write_text('')
+    store = str(tmp_path)
+    assert get_dset_path('zara1', 'train', store) == os.path.join(
+        store, 'manifests', 'datasets', 'zara1', 'train.manifest')
+    assert get_dset_path('zara1', 'train', store, 'datasets2') == os.path.join(
+        store, 'manifests', 'datasets2', 'zara1', 'train.manifest')
+    with pytest.raises(ValueError):
+        get_dset_path('zara1', 'val', store)
+
+
+def test_get_dset_path_tree():
+    path = get_dset_path('zara1', 'train')
+    assert path.endswith(os.path.join('datasets', 'zara1', 'train'))
+    assert get_dset_path('zara1', 'train', tree='datasets2').endswith(
+        os.path.join('datasets2', 'zara1', 'train'))
+
+
+def seq_start_end_of(lengths):
+    ends = torch.tensor(lengths).cumsum(0)
+    return torch.stack([ends - torch.tensor(lengths), ends], dim=1)
+
+
+@pytest.mark.parametrize('reduce, reference', [
+    (segment_sum, lambda x: x.sum(0)),
+    (segment_mean, lambda x: x.mean(0)),
+    (segment_min, lambda x: x.min(0)[0]),
+    (segment_max, lambda x: x.max(0)[0]),
+])
+def test_segment_reductions(reduce, reference):
+    seq_start_end = seq_start_end_of([3, 1, 4, 2])
+    x = torch.randn(10, 5, 2)
+    expected = torch.stack(
+        [reference(x[start:end]) for start, end in seq_start_end.tolist()])
+    assert torch.allclose(reduce(x, seq_start_end), expected)
+    assert torch.allclose(reduce(x, Segments(seq_start_end)), expected)
+
+
+def test_segment_broadcast():
+    seq_start_end = seq_start_end_of([2, 3])
+    x = torch.tensor([[1.], [2.]])
+    assert segment_broadcast(x, seq_start_end).view(-1).tolist() == [
+        1, 1, 2, 2, 2]
+
+
+def test_segments_inference_mode():
+    if not hasattr(torch, 'inference_mode'):
+        pytest.skip('torch.inference_mode needs torch >= 1.9')
+    with torch.inference_mode():
+        seq_start_end = seq_start_end_of([2, 3])
+        x = torch.ones(5, 2)
+        assert segment_sum(x, seq_start_end).tolist() == [[2, 2], [3, 3]]